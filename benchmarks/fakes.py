@@ -0,0 +1,204 @@
+"""
+Детерминированные заменители внешних сервисов для офлайн-бенчмарков:
+синтетические сообщения в форме Telethon Message, клиент Telethon, эндпоинт
+эмбеддингов с зафиксированными векторами и задержкой, LLM и бот Bot API.
+"""
+import asyncio
+import hashlib
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import List, Optional
+
+import numpy as np
+
+WORDS = (
+    'деплой релиз прод баг тест ревью митинг задача спринт бэклог кофе обед отпуск сервер база '
+    'индекс запрос ответ логи алерт мониторинг докер кубер питон фронт бэк дизайн макет клиент '
+    'дедлайн созвон оценка рефакторинг миграция кэш очередь воркер таймаут ретрай метрика график'
+).split()
+DOMAINS = ('github.com', 'habr.com', 'docs.python.org', 'stackoverflow.com', 'youtube.com')
+
+
+@dataclass
+class FakeUser:
+    id: int
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+
+
+@dataclass
+class FakeDocument:
+    attributes: list = field(default_factory=list)
+
+
+class MessageMediaPhoto:
+    pass
+
+
+class MessageMediaDocument:
+    pass
+
+
+@dataclass
+class FakeMessage:
+    """Подмножество атрибутов telethon.tl.custom.Message, которое читает пайплайн."""
+    id: int
+    date: datetime
+    text: str
+    sender_id: int
+    sender: FakeUser
+    reply_to_msg_id: Optional[int] = None
+    photo: object = None
+    document: object = None
+    video: object = None
+    voice: object = None
+    media: object = None
+    fwd_from: object = None
+
+
+def make_users(count: int, seed: int = 0) -> List[FakeUser]:
+    rng = random.Random(seed)
+    users = []
+    for i in range(count):
+        user_id = 1000 + i
+        if rng.random() < 0.7:
+            users.append(FakeUser(user_id, username=f'user{i}'))
+        else:
+            users.append(FakeUser(user_id, first_name=f'Имя{i}', last_name=f'Фамилия{i}'))
+    return users
+
+
+def _make_text(rng: random.Random) -> str:
+    roll = rng.random()
+    if roll < 0.03:
+        return '/start'
+    if roll < 0.10:
+        return rng.choice(('+', 'ок', 'ага', 'лол', '👍'))
+    words = rng.choices(WORDS, k=rng.randint(3, 40))
+    if rng.random() < 0.1:
+        words.append(f'https://{rng.choice(DOMAINS)}/{rng.randint(1, 10 ** 6)}')
+    if rng.random() < 0.03:
+        words.append('```\n' + '\n'.join(rng.choices(WORDS, k=rng.randint(2, 20))) + '\n```')
+    if rng.random() < 0.02:
+        words.append('#важное')
+    return ' '.join(words)
+
+
+def generate_messages(count: int, days: int = 7, users: int = 50, seed: int = 0,
+                      start_id: int = 1) -> List[FakeMessage]:
+    """
+    Сообщения за последние days дней в порядке iter_messages: от новых к старым.
+    Около трети — ответы на недавние сообщения, часть — медиа, команды и короткие реплики.
+    """
+    rng = random.Random(seed)
+    people = make_users(users, seed)
+    now = datetime.now(timezone.utc)
+    step = timedelta(days=days) / max(count, 1)
+    messages = []
+    for i in range(count):
+        msg_id = start_id + i
+        sender = rng.choice(people)
+        msg = FakeMessage(
+            id=msg_id,
+            date=now - timedelta(days=days) + step * i,
+            text=_make_text(rng),
+            sender_id=sender.id,
+            sender=sender,
+        )
+        if i and rng.random() < 0.3:
+            msg.reply_to_msg_id = msg_id - rng.randint(1, min(i, 20))
+        roll = rng.random()
+        if roll < 0.05:
+            msg.photo = msg.media = MessageMediaPhoto()
+        elif roll < 0.07:
+            msg.document = FakeDocument([SimpleNamespace(file_name=f'report_{i}.pdf')])
+            msg.media = MessageMediaDocument()
+        messages.append(msg)
+    messages.reverse()
+    return messages
+
+
+class FakeTelegramClient:
+    """Клиент Telethon с историей в памяти: iter_messages и get_participants."""
+
+    def __init__(self, messages: List[FakeMessage], users: List[FakeUser]):
+        self.messages = messages
+        self.users = users
+
+    async def iter_messages(self, entity, min_id: int = 0, offset_date: Optional[datetime] = None):
+        for i, msg in enumerate(self.messages):
+            if msg.id <= min_id:
+                break
+            if offset_date is not None and msg.date >= offset_date:
+                continue
+            # Отдаём управление циклу, как при постраничной загрузке
+            if i % 100 == 0:
+                await asyncio.sleep(0)
+            yield msg
+
+    async def get_participants(self, entity):
+        return self.users
+
+
+def seeded_vector(text: str, dim: int) -> np.ndarray:
+    """Один и тот же текст всегда даёт один и тот же вектор."""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+class FakeEmbeddingsClient:
+    """Заменяет AsyncOpenAI: client.embeddings.create(model, input) с задержкой на запрос."""
+
+    def __init__(self, dim: int = 256, latency: float = 0.05):
+        self.dim = dim
+        self.latency = latency
+        self.requests = 0
+        self.embeddings = self
+
+    async def create(self, model: str, input: List[str]):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        data = [SimpleNamespace(index=i, embedding=seeded_vector(text, self.dim))
+                for i, text in enumerate(input)]
+        usage = SimpleNamespace(total_tokens=sum(len(text) // 3 for text in input))
+        return SimpleNamespace(data=data, usage=usage)
+
+    async def close(self):
+        pass
+
+
+class FakeLLM:
+    """Заменяет LangChain runnable: ainvoke возвращает валидный LLMResponse после задержки."""
+
+    def __init__(self, latency: float = 0.5):
+        self.latency = latency
+        self.calls = 0
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        size = sum(len(message.content) for message in messages)
+        return {
+            'main_fragments': [f'Обсуждали {size} символов переписки'],
+            'failures_and_rage': ['Упал прод'],
+            'topics_to_discuss': ['Ретро по релизу'],
+        }
+
+
+class FakeBot:
+    """Заменяет aiogram Bot: запоминает отправленные сообщения."""
+
+    def __init__(self, latency: float = 0.01):
+        self.latency = latency
+        self.sent = []
+        self.session = self
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        await asyncio.sleep(self.latency)
+        self.sent.append((chat_id, text))
+
+    async def close(self):
+        pass
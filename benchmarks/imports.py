@@ -0,0 +1,64 @@
+"""
+Профиль импорта: время, пиковый RSS и загруженные тяжёлые зависимости для точек входа.
+
+Каждый модуль импортируется в отдельном чистом процессе, поэтому числа не зависят
+от порядка измерений.
+
+    python -m benchmarks.imports
+    python -m benchmarks.imports --modules src.telegram.bot src.scheduler.scheduler --repeat 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = ('main', 'src.telegram.bot', 'src.scheduler.scheduler', 'src.llm.client')
+HEAVY_MODULES = ('faiss', 'numpy', 'langchain_openai', 'langchain_ollama', 'openai', 'telethon', 'aiogram')
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    'import_s': elapsed,
+    'peak_rss_mb': peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024,
+    'heavy': [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def probe(module: str) -> dict:
+    code = PROBE.format(module=module, heavy=HEAVY_MODULES)
+    completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=ROOT_DIR)
+    if completed.returncode != 0:
+        return {'error': completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Профиль времени импорта точек входа')
+    parser.add_argument('--modules', nargs='+', default=list(DEFAULT_MODULES))
+    parser.add_argument('--repeat', type=int, default=3, help='замеров на модуль (берётся минимум)')
+    args = parser.parse_args(argv)
+
+    for module in args.modules:
+        runs = [probe(module) for _ in range(args.repeat)]
+        ok = [run for run in runs if 'error' not in run]
+        if not ok:
+            print(json.dumps({'module': module, 'error': runs[-1]['error']}, ensure_ascii=False))
+            continue
+        best = min(ok, key=lambda run: run['import_s'])
+        print(json.dumps({
+            'module': module,
+            'import_ms': round(best['import_s'] * 1000, 1),
+            'peak_rss_mb': round(best['peak_rss_mb'], 1),
+            'heavy_loaded': best['heavy'],
+        }, ensure_ascii=False), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""
+Офлайн-бенчмарки пайплайна без Telegram и OpenAI.
+
+Сценарии:
+  normalize — фильтрация и нормализация сообщений Telethon, запись и чтение архива;
+  index     — индексация MessageVectorStore и поиск по нему;
+  pipeline  — полный pipeline(job): загрузка, индекс, RAG, LLM, отправка.
+
+Каждый сценарий и размер запускаются в отдельном процессе с временным DATA_DIR,
+поэтому пиковый RSS относится только к нему.
+
+    python -m benchmarks.run --sizes 1000 10000 100000 --cases normalize index pipeline
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASES = ('normalize', 'index', 'pipeline')
+BENCH_CHAT_KEY = -100500
+BENCH_DESTINATION = '-100600'
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    import numpy as np
+    if not samples:
+        return {}
+    values = np.array(samples) * 1000
+    return {f'p{q}_ms': round(float(np.percentile(values, q)), 3) for q in (50, 95, 99)}
+
+
+def prepare_env(args, data_dir: str):
+    """Окружение задаётся до импорта src: пути — во временный каталог, внешние сервисы не нужны."""
+    os.environ.update({
+        'DATA_DIR': data_dir,
+        'ARCHIVE_PATH': os.path.join(data_dir, 'archive.sqlite3'),
+        'RAG_CACHE_PATH': os.path.join(data_dir, 'embeddings.sqlite3'),
+        'LLM_CACHE_PATH': os.path.join(data_dir, 'llm_cache.sqlite3'),
+        'RAG_INDEX_DIR': os.path.join(data_dir, 'indexes'),
+        'METRICS_DIR': os.path.join(data_dir, 'metrics'),
+        'PARTIALS_PATH': os.path.join(data_dir, 'partials.sqlite3'),
+        'LEDGER_PATH': os.path.join(data_dir, 'ledger.sqlite3'),
+        'RAG_API_KEY': 'benchmark',
+        'LLM_API_KEY': 'benchmark',
+        'LLM_PROVIDER': 'openai',
+        'LLM_CACHE_MODE': 'off',
+        'SUMMARY_MODE': args.summary_mode,
+        'RAG_INDEX_TYPE': args.index_type,
+        'RAG_PROVIDER': args.rag_provider,
+        'JOBS_FILE': '',
+    })
+
+
+def install_embeddings(args):
+    """
+    Подменяет клиент OpenAI-совместимого бэкенда фейковым эндпоинтом.
+    С --rag-provider local используется настоящая локальная модель.
+    """
+    from benchmarks.fakes import FakeEmbeddingsClient
+    from src.llm import embeddings
+
+    if args.rag_provider == 'local':
+        return None
+    client = FakeEmbeddingsClient(args.dim, args.embed_latency)
+    embeddings._backend = embeddings.OpenAIEmbeddingBackend(client=client)
+    return client
+
+
+def install_fakes(args, messages, users):
+    """Подменяет Telegram, эмбеддинги, LLM и Bot API детерминированными заглушками."""
+    from benchmarks.fakes import FakeBot, FakeLLM, FakeTelegramClient
+    from src.llm import client as llm_client
+    from src.scheduler import ingest
+    from src.telegram.sender import report_sender
+
+    embeddings_client = install_embeddings(args)
+    llm = FakeLLM(args.llm_latency)
+    llm_client.get_langchain_llm = lambda model=None, provider=None: llm
+    telegram = FakeTelegramClient(messages, users)
+
+    async def open_chat(chat_id_or_username):
+        return telegram, object(), BENCH_CHAT_KEY
+
+    ingest.open_chat = open_chat
+    report_sender._bot = FakeBot()
+    return embeddings_client, llm
+
+
+async def bench_normalize(args, messages, users) -> Dict:
+    from datetime import datetime, timedelta
+    from src.storage.archive import get_archive
+    from src.telegram.sender_cache import SenderCache
+    from src.telegram.telethon_client import is_relevant, normalize_message
+
+    archive = get_archive()
+    senders = SenderCache()
+    batch_times = []
+    stored = 0
+    started = time.perf_counter()
+    for offset in range(0, len(messages), args.batch_size):
+        batch_started = time.perf_counter()
+        batch = [normalize_message(msg, senders) for msg in messages[offset:offset + args.batch_size]
+                 if is_relevant(msg)]
+        archive.save_messages(BENCH_CHAT_KEY, batch)
+        stored += len(batch)
+        batch_times.append(time.perf_counter() - batch_started)
+    elapsed = time.perf_counter() - started
+
+    read_started = time.perf_counter()
+    window = archive.get_messages(BENCH_CHAT_KEY, datetime.now() - timedelta(days=args.days + 1))
+    read_elapsed = time.perf_counter() - read_started
+    return {
+        'throughput_msg_s': round(len(messages) / elapsed, 1),
+        'batch_latency': percentiles(batch_times),
+        'stored': stored,
+        'archive_read_s': round(read_elapsed, 3),
+        'archive_read_msg_s': round(len(window) / read_elapsed, 1) if read_elapsed else None,
+    }
+
+
+async def bench_index(args, messages, users) -> Dict:
+    import random
+    from benchmarks.fakes import seeded_vector
+    from src.llm.vector_store import MessageVectorStore
+    from src.telegram.sender_cache import SenderCache
+    from src.telegram.telethon_client import is_relevant, normalize_message
+
+    embeddings_client = install_embeddings(args)
+    senders = SenderCache()
+    records = [normalize_message(msg, senders).to_dict() for msg in messages if is_relevant(msg)]
+    store = MessageVectorStore()
+    batch_times = []
+    started = time.perf_counter()
+    for offset in range(0, len(records), args.batch_size):
+        batch_started = time.perf_counter()
+        await store.add_messages(records[offset:offset + args.batch_size])
+        batch_times.append(time.perf_counter() - batch_started)
+    index_elapsed = time.perf_counter() - started
+
+    rng = random.Random(0)
+    window_ids = [record['id'] for record in records[:len(records) // 2]]
+    search_times, window_times = [], []
+    for i in range(args.queries):
+        query = seeded_vector(f'query {i} ' + rng.choice(records)['text'], args.dim)
+        search_started = time.perf_counter()
+        store.search(query, top_k=args.top_k)
+        search_times.append(time.perf_counter() - search_started)
+        search_started = time.perf_counter()
+        store.search(query, top_k=args.top_k, ids=window_ids)
+        window_times.append(time.perf_counter() - search_started)
+    return {
+        'indexed': len(store.messages),
+        'embedding_requests': embeddings_client.requests if embeddings_client else None,
+        'index_throughput_msg_s': round(len(records) / index_elapsed, 1),
+        'add_batch_latency': percentiles(batch_times),
+        'search_latency': percentiles(search_times),
+        'search_qps': round(len(search_times) / sum(search_times), 1),
+        'window_search_latency': percentiles(window_times),
+    }
+
+
+async def bench_pipeline(args, messages, users) -> Dict:
+    from src.llm.client import close_llm_clients
+    from src.metrics.metrics import METRICS_DIR
+    from src.scheduler.scheduler import pipeline
+
+    embeddings_client, llm = install_fakes(args, messages, users)
+    job = {
+        'name': 'benchmark',
+        'chat_id': str(BENCH_CHAT_KEY),
+        'destinations': [BENCH_DESTINATION],
+        'day_offset': args.days,
+        'rag_queries': None,
+        'top_k': args.top_k,
+        'mode': 'full',
+        # Окно отчёта заканчивается на последнем плановом запуске — берём ежеминутное расписание
+        'schedule': {'minute': '*'},
+    }
+    started = time.perf_counter()
+    await pipeline(job)
+    elapsed = time.perf_counter() - started
+    await close_llm_clients()
+    with open(os.path.join(METRICS_DIR, 'runs.jsonl'), encoding='utf-8') as f:
+        run = json.loads(f.readlines()[-1])
+    return {
+        'duration_s': round(elapsed, 3),
+        'throughput_msg_s': round(len(messages) / elapsed, 1),
+        'embedding_requests': embeddings_client.requests if embeddings_client else None,
+        'llm_calls': llm.calls,
+        'stages_s': {name: stage['duration_seconds'] for name, stage in run['stages'].items()},
+        'counters': run['counters'],
+    }
+
+
+BENCHMARKS = {'normalize': bench_normalize, 'index': bench_index, 'pipeline': bench_pipeline}
+
+
+def run_case(args) -> Dict:
+    """Выполняет один сценарий в текущем процессе."""
+    with tempfile.TemporaryDirectory(prefix='digest-bench-') as data_dir:
+        prepare_env(args, data_dir)
+        from benchmarks.fakes import generate_messages, make_users
+        users = make_users(args.users, args.seed)
+        messages = generate_messages(args.size, days=args.days, users=args.users, seed=args.seed)
+        result = asyncio.run(BENCHMARKS[args.case](args, messages, users))
+    result.update({'case': args.case, 'size': args.size, 'peak_rss_mb': round(peak_rss_mb(), 1)})
+    return result
+
+
+def run_isolated(args, case: str, size: int) -> Dict:
+    command = [sys.executable, '-m', 'benchmarks.run', '--case', case, '--size', str(size),
+               '--days', str(args.days), '--users', str(args.users), '--seed', str(args.seed),
+               '--dim', str(args.dim), '--embed-latency', str(args.embed_latency),
+               '--llm-latency', str(args.llm_latency), '--batch-size', str(args.batch_size),
+               '--queries', str(args.queries), '--top-k', str(args.top_k),
+               '--index-type', args.index_type, '--summary-mode', args.summary_mode,
+               '--rag-provider', args.rag_provider]
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=ROOT_DIR)
+    if completed.returncode != 0:
+        return {'case': case, 'size': size, 'error': completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Офлайн-бенчмарки пайплайна дайджеста')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--case', choices=CASES, help='выполнить один сценарий в текущем процессе')
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dim', type=int, default=256, help='размерность фейковых эмбеддингов')
+    parser.add_argument('--embed-latency', type=float, default=0.05, help='задержка запроса эмбеддингов, с')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='задержка ответа LLM, с')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=50)
+    parser.add_argument('--index-type', default='flat_l2')
+    parser.add_argument('--summary-mode', default='rag', choices=('rag', 'map_reduce'))
+    parser.add_argument('--rag-provider', default='openai', choices=('openai', 'local'),
+                        help='openai — фейковый эндпоинт, local — локальная модель sentence-transformers')
+    parser.add_argument('--output', help='сохранить результаты в JSON-файл')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.case:
+        print(json.dumps(run_case(args), ensure_ascii=False))
+        return
+    results = []
+    for size in args.sizes:
+        for case in args.cases:
+            result = run_isolated(args, case, size)
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
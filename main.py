@@ -3,30 +3,57 @@ import logging
 import sys
 
 from src.config.config import load_config
-from src.scheduler.scheduler import schedule_weekly_job
-from src.telegram.bot import run_bot
 
 config = load_config()
 MODE = config['MODE']
 
+
+async def run_bot():
+    # Модули импортируются по режиму: боту не нужны LangChain, faiss и numpy
+    from src.telegram.bot import run_bot
+    await run_bot()
+
+
+async def run_scheduler():
+    from src.scheduler.scheduler import schedule_weekly_job
+    await schedule_weekly_job()
+
+
+async def shutdown():
+    """Закрывает общие клиенты только тех модулей, которые были загружены."""
+    if 'src.telegram.client_manager' in sys.modules:
+        from src.telegram.client_manager import shutdown_telegram_client
+        await shutdown_telegram_client()
+    if 'src.llm.client' in sys.modules:
+        from src.llm.client import close_llm_clients
+        await close_llm_clients()
+    if 'src.telegram.sender' in sys.modules:
+        from src.telegram.sender import close_sender
+        await close_sender()
+
+
 async def main():
-    # Если явно указан режим
-    if len(sys.argv) > 1:
-        mode = sys.argv[1]
-        if mode == 'bot':
-            asyncio.run(run_bot())
-            return
-        elif mode == 'scheduler':
-            asyncio.run(schedule_weekly_job())
-            return
-        else:
-            logging.warning("Неизвестный режим. Используйте 'bot' или 'scheduler'.")
-            return
-
-    await asyncio.gather(
-        run_bot(),
-        schedule_weekly_job()
-    )
+    try:
+        # Если явно указан режим
+        if len(sys.argv) > 1:
+            mode = sys.argv[1]
+            if mode == 'bot':
+                await run_bot()
+                return
+            elif mode == 'scheduler':
+                await run_scheduler()
+                return
+            else:
+                logging.warning("Неизвестный режим. Используйте 'bot' или 'scheduler'.")
+                return
+
+        # Бот и планировщик работают в одном event loop и делят один Telethon-клиент
+        await asyncio.gather(
+            run_bot(),
+            run_scheduler()
+        )
+    finally:
+        await shutdown()
 
 
 if __name__ == "__main__":
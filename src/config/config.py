@@ -1,52 +1,303 @@
+import json
 import os
-from typing import List, Optional, TypeVar
+from functools import lru_cache
+from typing import Dict, List, Optional, TypeVar
 from dotenv import load_dotenv
 
 T = TypeVar('T')
 load_dotenv()
 
+MODES = ('both', 'bot', 'scheduler')
+LLM_PROVIDERS = ('openai', 'ollama')
+RAG_PROVIDERS = ('openai', 'local')
+SUMMARY_MODES = ('rag', 'map_reduce')
+CACHE_MODES = ('on', 'refresh', 'off')
+INDEX_TYPES = ('flat_l2', 'flat_ip', 'hnsw', 'ivf_flat', 'ivf_pq')
+CATCHUP_POLICIES = ('latest', 'none')
+DIGEST_MODES = ('full', 'incremental')
+# Реплики без информации: «+1», «ок», «спасибо», смех, одни эмодзи и знаки препинания.
+# Посессивный квантификатор (Python 3.11+) исключает экспоненциальный перебор на длинных строках
+DEFAULT_NOISE_PATTERN = (r'(?:[+-]\d*|ок(?:ей)?|ok(?:ay)?|да|нет|ага|угу|ясно|понял[а]?|спасибо|спс|thx|thanks'
+                         r'|лол|lol|кек|а?(?:ха)+|\W)*+')
 
-def load_config():
+
+@lru_cache(maxsize=None)
+def load_config() -> Dict:
+    """
+    Читает и проверяет конфигурацию из окружения один раз за процесс;
+    повторные вызовы возвращают тот же словарь.
+    """
+    config = read_config()
+    validate_config(config)
+    return config
+
+
+def read_config() -> Dict:
     llm_provider = os.getenv('LLM_PROVIDER', 'openai')
     llm_model = os.getenv('LLM_MODEL', os.getenv('LLM_MODEL', 'gpt-3.5-turbo'))
     llm_base_url = os.getenv('LLM_BASE_URL', os.getenv('LLM_BASE_URL'))
     llm_api_key = os.getenv('LLM_API_KEY', os.getenv('LLM_API_KEY', ''))
+    llm_timeout = float(os.getenv('LLM_TIMEOUT', 120))
 
-    rag_model = os.getenv('RAG_MODEL', os.getenv('RAG_MODEL', 'text-embedding-3-small'))
+    rag_provider = os.getenv('RAG_PROVIDER', 'openai').lower()
+    default_rag_model = ('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+                         if rag_provider == 'local' else 'text-embedding-3-small')
+    rag_model = os.getenv('RAG_MODEL') or default_rag_model
     rag_base_url = os.getenv('RAG_BASE_URL', os.getenv('RAG_BASE_URL'))
     rag_api_key = os.getenv('RAG_API_KEY', os.getenv('RAG_API_KEY'))
     rag_query = os.getenv('RAG_QUERY', 'Главные события недели, факапы, темы для обсуждения')
+    rag_queries = [query.strip() for query in os.getenv('RAG_QUERIES', '').split('|') if query.strip()]
     rag_top_k = int(os.getenv('RAG_TOP_K', 50))
+    rag_index_type = os.getenv('RAG_INDEX_TYPE', 'flat_l2').lower()
+    rag_batch_size = int(os.getenv('RAG_BATCH_SIZE', 256))
+    rag_batch_tokens = int(os.getenv('RAG_BATCH_TOKENS', 100000))
+    rag_max_input_tokens = int(os.getenv('RAG_MAX_INPUT_TOKENS', 8000))
+    rag_concurrency = int(os.getenv('RAG_CONCURRENCY', 4))
+    rag_max_retries = int(os.getenv('RAG_MAX_RETRIES', 5))
+
+    data_dir = os.getenv('DATA_DIR', 'data')
+    day_offset = abs(int(os.getenv('DAY_OFFSET', 7)))
+    digest_mode = os.getenv('DIGEST_MODE', 'full').lower()
+    rag_cache_path = os.getenv('RAG_CACHE_PATH') or os.path.join(data_dir, 'embeddings.sqlite3')
+    rag_cache_max_items = int(os.getenv('RAG_CACHE_MAX_ITEMS', 200000))
 
     return {
         'BOT_TOKEN': os.getenv('BOT_TOKEN'),
         'MODE': os.environ.get("MODE", "both").lower(),
         'TELEGRAM_CHAT_ID': os.getenv('TELEGRAM_CHAT_ID'),
         'TELEGRAM_DIST_CHAT_ID': os.getenv('TELEGRAM_DIST_CHAT_ID'),
-        'TELEGRAM_API_ID': int(os.getenv('TELEGRAM_API_ID')),
+        # Не обязателен при импорте: без него работают бенчмарки и режимы без Telethon
+        'TELEGRAM_API_ID': int(os.getenv('TELEGRAM_API_ID')) if os.getenv('TELEGRAM_API_ID') else None,
         'TELEGRAM_API_HASH': os.getenv('TELEGRAM_API_HASH'),
         'TELEGRAM_PHONE': os.getenv('TELEGRAM_PHONE'),
         'TELEGRAM_SESSION_NAME': os.getenv('TELEGRAM_SESSION_NAME', 'anon'),
         'IGNORED_SENDER_IDS': extract_list_from_env('IGNORED_SENDER_IDS', convert_type=int),
-        'DAY_OFFSET': abs(int(os.getenv('DAY_OFFSET', 7))),
+        'DAY_OFFSET': day_offset,
         'HASHTAGS': extract_list_from_env('HASHTAGS', convert_type=str),
-        'TELEGRAM_OWNER_ID': os.getenv('TELEGRAM_OWNER_ID'),
+        'TELEGRAM_OWNER_ID': int(os.getenv('TELEGRAM_OWNER_ID')) if os.getenv('TELEGRAM_OWNER_ID') else None,
+        'DATA_DIR': data_dir,
+        'INGEST_BATCH_SIZE': int(os.getenv('INGEST_BATCH_SIZE', 500)),
+        'INGEST_QUEUE_SIZE': int(os.getenv('INGEST_QUEUE_SIZE', 4)),
+        'SENDER_CACHE_TTL': float(os.getenv('SENDER_CACHE_TTL_HOURS', 24)) * 3600,
+        'SENDER_CACHE_WARM': os.getenv('SENDER_CACHE_WARM', 'true').lower() in ('1', 'true', 'yes'),
+        'SENDER_CONFIG': {
+            'global_rate': float(os.getenv('TELEGRAM_SEND_GLOBAL_RATE', 25)),
+            'chat_rate': float(os.getenv('TELEGRAM_SEND_CHAT_RATE', 0.33)),
+            'chat_burst': float(os.getenv('TELEGRAM_SEND_CHAT_BURST', 3)),
+            'max_retries': int(os.getenv('TELEGRAM_SEND_MAX_RETRIES', 5)),
+        },
+        'SCHEDULER_TIMEZONE': os.getenv('SCHEDULER_TIMEZONE', 'Europe/Moscow'),
+        'JOBS_CONCURRENCY': int(os.getenv('JOBS_CONCURRENCY', 2)),
+        'DIGEST_MODE': digest_mode,
+        'DIGEST_QUEUE_SIZE': int(os.getenv('DIGEST_QUEUE_SIZE', 10)),
+        'DIGEST_CACHE_TTL': float(os.getenv('DIGEST_CACHE_TTL_MINUTES', 60)) * 60,
+        'DIGEST_MAX_DAYS': int(os.getenv('DIGEST_MAX_DAYS', 31)),
+        'JOBS': load_jobs(
+            os.getenv('JOBS_FILE'),
+            default_chat_id=os.getenv('TELEGRAM_CHAT_ID'),
+            default_destination=os.getenv('TELEGRAM_DIST_CHAT_ID'),
+            default_day_offset=day_offset,
+            default_mode=digest_mode,
+        ),
+        'ARCHIVE_PATH': os.getenv('ARCHIVE_PATH') or os.path.join(data_dir, 'archive.sqlite3'),
+        'ARCHIVE_RETENTION_DAYS': int(os.getenv('ARCHIVE_RETENTION_DAYS', 30)),
+        'PARTIALS_PATH': os.getenv('PARTIALS_PATH') or os.path.join(data_dir, 'partials.sqlite3'),
+        'LEDGER_PATH': os.getenv('LEDGER_PATH') or os.path.join(data_dir, 'ledger.sqlite3'),
+        'SCHEDULER_CATCHUP': os.getenv('SCHEDULER_CATCHUP', 'latest').lower(),
+        'SCHEDULER_MISFIRE_GRACE': float(os.getenv('SCHEDULER_MISFIRE_GRACE_HOURS', 24)) * 3600,
+        'METRICS_DIR': os.getenv('METRICS_DIR') or os.path.join(data_dir, 'metrics'),
         'LLM_CONFIG': {
             'provider': llm_provider,
             'model': llm_model,
             'base_url': llm_base_url,
             'api_key': llm_api_key,
+            'temperature': float(os.getenv('LLM_TEMPERATURE', 0.2)),
+            'cache_mode': os.getenv('LLM_CACHE_MODE', 'on').lower(),
+            'cache_path': os.getenv('LLM_CACHE_PATH') or os.path.join(data_dir, 'llm_cache.sqlite3'),
+            'cache_ttl': float(os.getenv('LLM_CACHE_TTL_HOURS', 7 * 24)) * 3600,
+            'cache_max_entries': int(os.getenv('LLM_CACHE_MAX_ENTRIES', 5000)),
+            'timeout': llm_timeout,
+            # Резервные модели после основной, по порядку: provider:model[@таймаут]
+            'fallbacks': [parse_llm_target(item, llm_timeout)
+                          for item in extract_list_from_env('LLM_FALLBACKS', remove_duplicates=False)],
+            'hedge': os.getenv('LLM_HEDGE', 'false').lower() in ('1', 'true', 'yes'),
+            'hedge_min_delay': float(os.getenv('LLM_HEDGE_MIN_DELAY', 5)),
+            'breaker_failures': int(os.getenv('LLM_BREAKER_FAILURES', 3)),
+            'breaker_cooldown': float(os.getenv('LLM_BREAKER_COOLDOWN', 60)),
+            'http_max_connections': int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', 20)),
+            'context_budget': int(os.getenv('LLM_CONTEXT_BUDGET', 6000)),
+            'max_message_tokens': int(os.getenv('LLM_MAX_MESSAGE_TOKENS', 300)),
+            'summary_mode': os.getenv('SUMMARY_MODE', 'rag').lower(),
+            'chunk_tokens': int(os.getenv('MAX_TOKENS_PER_CHUNK', 3000)),
+            'concurrency': int(os.getenv('LLM_CONCURRENCY', 4)),
         },
         'RAG_CONFIG': {
+            'provider': rag_provider,
             'model': rag_model,
             'base_url': rag_base_url,
             'api_key': rag_api_key,
             'query': rag_query,
-            'top_k': rag_top_k
+            'queries': rag_queries or [rag_query],
+            'top_k': rag_top_k,
+            'candidate_multiplier': int(os.getenv('RAG_CANDIDATE_MULTIPLIER', 3)),
+            'mmr_lambda': float(os.getenv('RAG_MMR_LAMBDA', 0.7)),
+            'must_include_pattern': (os.getenv('RAG_MUST_INCLUDE_PATTERN')
+                                     or r'(дн[её]м?\s+рождени|\bс\s+др\b|поздравл)'),
+            'index_type': rag_index_type,
+            'hnsw_m': int(os.getenv('RAG_HNSW_M', 32)),
+            'hnsw_ef_construction': int(os.getenv('RAG_HNSW_EF_CONSTRUCTION', 200)),
+            'hnsw_ef_search': int(os.getenv('RAG_HNSW_EF_SEARCH', 64)),
+            'ivf_nlist': int(os.getenv('RAG_IVF_NLIST', 1024)),
+            'ivf_nprobe': int(os.getenv('RAG_IVF_NPROBE', 16)),
+            'ivf_pq_m': int(os.getenv('RAG_IVF_PQ_M', 16)),
+            'conversation_gap_minutes': int(os.getenv('CONVERSATION_GAP_MINUTES', 10)),
+            'conversation_max_minutes': int(os.getenv('CONVERSATION_MAX_MINUTES', 120)),
+            'low_signal_max_chars': int(os.getenv('LOW_SIGNAL_MAX_CHARS', 15)),
+            'dedup': os.getenv('DEDUP_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+            'dedup_max_distance': int(os.getenv('DEDUP_MAX_DISTANCE', 3)),
+            'dedup_shingle_size': int(os.getenv('DEDUP_SHINGLE_SIZE', 3)),
+            'noise_pattern': os.getenv('NOISE_PATTERN') or DEFAULT_NOISE_PATTERN,
+            'batch_size': rag_batch_size,
+            'batch_tokens': rag_batch_tokens,
+            'max_input_tokens': rag_max_input_tokens,
+            'concurrency': rag_concurrency,
+            'max_retries': rag_max_retries,
+            'local_device': os.getenv('RAG_LOCAL_DEVICE', 'cpu'),
+            'local_batch_size': int(os.getenv('RAG_LOCAL_BATCH_SIZE', 64)),
+            'local_workers': int(os.getenv('RAG_LOCAL_WORKERS', 1)),
+            'index_dir': os.getenv('RAG_INDEX_DIR') or os.path.join(data_dir, 'indexes'),
+            'retention_days': int(os.getenv('RAG_RETENTION_DAYS', 30)),
+            'cache_path': rag_cache_path,
+            'cache_max_items': rag_cache_max_items,
         }
     }
 
 
+def validate_config(config: Dict):
+    """Проверяет значения конфигурации; при ошибках падает со списком всех проблем сразу."""
+    llm, rag = config['LLM_CONFIG'], config['RAG_CONFIG']
+    errors = []
+
+    def check_choice(name: str, value, choices):
+        if value not in choices:
+            errors.append(f"{name}={value!r}: допустимо {', '.join(choices)}")
+
+    def check_positive(name: str, value):
+        if value <= 0:
+            errors.append(f'{name}={value!r}: должно быть больше нуля')
+
+    check_choice('MODE', config['MODE'], MODES)
+    check_choice('DIGEST_MODE', config['DIGEST_MODE'], DIGEST_MODES)
+    check_choice('SCHEDULER_CATCHUP', config['SCHEDULER_CATCHUP'], CATCHUP_POLICIES)
+    check_choice('LLM_PROVIDER', llm['provider'], LLM_PROVIDERS)
+    check_choice('SUMMARY_MODE', llm['summary_mode'], SUMMARY_MODES)
+    check_choice('LLM_CACHE_MODE', llm['cache_mode'], CACHE_MODES)
+    for target in llm['fallbacks']:
+        check_choice('LLM_FALLBACKS', target['provider'], LLM_PROVIDERS)
+        check_positive('LLM_FALLBACKS', target['timeout'])
+    check_choice('RAG_PROVIDER', rag['provider'], RAG_PROVIDERS)
+    check_choice('RAG_INDEX_TYPE', rag['index_type'], INDEX_TYPES)
+    for name, value in (
+            ('INGEST_BATCH_SIZE', config['INGEST_BATCH_SIZE']),
+            ('INGEST_QUEUE_SIZE', config['INGEST_QUEUE_SIZE']),
+            ('JOBS_CONCURRENCY', config['JOBS_CONCURRENCY']),
+            ('ARCHIVE_RETENTION_DAYS', config['ARCHIVE_RETENTION_DAYS']),
+            ('DIGEST_QUEUE_SIZE', config['DIGEST_QUEUE_SIZE']),
+            ('DIGEST_MAX_DAYS', config['DIGEST_MAX_DAYS']),
+            ('SCHEDULER_MISFIRE_GRACE_HOURS', config['SCHEDULER_MISFIRE_GRACE']),
+            ('LLM_TIMEOUT', llm['timeout']),
+            ('LLM_CONTEXT_BUDGET', llm['context_budget']),
+            ('MAX_TOKENS_PER_CHUNK', llm['chunk_tokens']),
+            ('LLM_CONCURRENCY', llm['concurrency']),
+            ('LLM_HEDGE_MIN_DELAY', llm['hedge_min_delay']),
+            ('LLM_BREAKER_FAILURES', llm['breaker_failures']),
+            ('LLM_BREAKER_COOLDOWN', llm['breaker_cooldown']),
+            ('RAG_TOP_K', rag['top_k']),
+            ('RAG_BATCH_SIZE', rag['batch_size']),
+            ('RAG_CONCURRENCY', rag['concurrency']),
+            ('RAG_LOCAL_BATCH_SIZE', rag['local_batch_size']),
+            ('RAG_LOCAL_WORKERS', rag['local_workers']),
+            ('CONVERSATION_MAX_MINUTES', rag['conversation_max_minutes']),
+    ):
+        check_positive(name, value)
+    if not 0 <= rag['dedup_max_distance'] < 64:
+        errors.append(f"DEDUP_MAX_DISTANCE={rag['dedup_max_distance']!r}: должно быть от 0 до 63")
+    check_positive('DEDUP_SHINGLE_SIZE', rag['dedup_shingle_size'])
+    if not 0 <= rag['mmr_lambda'] <= 1:
+        errors.append(f"RAG_MMR_LAMBDA={rag['mmr_lambda']!r}: должно быть от 0 до 1")
+    if not 0 <= llm['temperature'] <= 2:
+        errors.append(f"LLM_TEMPERATURE={llm['temperature']!r}: должно быть от 0 до 2")
+    if errors:
+        raise ValueError('Некорректная конфигурация:\n  ' + '\n  '.join(errors))
+
+
+DEFAULT_SCHEDULE = {'day_of_week': 'sun', 'hour': 18, 'minute': 0}
+# В инкрементальном режиме: сразу после полуночи суммаризируется прошедший день
+DEFAULT_DAILY_SCHEDULE = {'hour': 0, 'minute': 15}
+
+
+def load_jobs(
+        jobs_file: Optional[str],
+        default_chat_id: Optional[str],
+        default_destination: Optional[str],
+        default_day_offset: int,
+        default_mode: str = 'full'
+) -> List[Dict]:
+    """
+    Загружает список задач дайджеста из JSON-файла JOBS_FILE.
+
+    Если файл не задан, формируется одна задача из TELEGRAM_CHAT_ID → TELEGRAM_DIST_CHAT_ID.
+    Каждая задача: chat_id, destinations, schedule (поля cron APScheduler), day_offset,
+    необязательные rag_queries и top_k, mode (full или incremental — дневные частичные
+    отчёты по daily_schedule и недельное сведение по schedule).
+    """
+    if not jobs_file:
+        if not default_chat_id:
+            return []
+        raw_jobs = [{'chat_id': default_chat_id, 'destinations': [default_destination]}]
+    else:
+        with open(jobs_file, encoding='utf-8') as f:
+            raw_jobs = json.load(f)
+
+    jobs = []
+    for i, raw in enumerate(raw_jobs):
+        destinations = raw.get('destinations') or []
+        if isinstance(destinations, str):
+            destinations = [destinations]
+        destinations = [str(destination) for destination in destinations if destination]
+        if not raw.get('chat_id') or not destinations:
+            raise ValueError(f"Задача #{i} в {jobs_file or 'окружении'}: нужны chat_id и destinations")
+        mode = raw.get('mode', default_mode)
+        if mode not in DIGEST_MODES:
+            raise ValueError(f"Задача #{i} в {jobs_file or 'окружении'}: mode={mode!r}, "
+                             f"допустимо {', '.join(DIGEST_MODES)}")
+        jobs.append({
+            'name': raw.get('name') or str(raw['chat_id']),
+            'chat_id': str(raw['chat_id']),
+            'destinations': destinations,
+            'schedule': {**DEFAULT_SCHEDULE, **raw.get('schedule', {})},
+            'day_offset': abs(int(raw.get('day_offset', default_day_offset))),
+            'rag_queries': raw.get('rag_queries'),
+            'top_k': raw.get('top_k'),
+            'mode': mode,
+            'daily_schedule': {**DEFAULT_DAILY_SCHEDULE, **raw.get('daily_schedule', {})},
+        })
+    return jobs
+
+
+def parse_llm_target(value: str, default_timeout: float) -> Dict:
+    """Разбирает цель маршрутизации LLM вида provider:model[@таймаут в секундах]."""
+    target, _, timeout = value.partition('@')
+    provider, _, model = target.partition(':')
+    if not model:
+        raise ValueError(f"LLM_FALLBACKS: {value!r}, ожидается provider:model[@таймаут]")
+    try:
+        timeout = float(timeout) if timeout else default_timeout
+    except ValueError:
+        raise ValueError(f"LLM_FALLBACKS: {value!r}, таймаут должен быть числом")
+    return {'provider': provider.lower(), 'model': model, 'timeout': timeout}
+
+
 def extract_list_from_env(
         env_key: str,
         default: str = '',
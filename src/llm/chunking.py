@@ -0,0 +1,43 @@
+"""
+Разбиение переписки на чанки с ограничением по токенам для map-reduce суммаризации.
+"""
+from typing import Dict, List, Set
+
+from src.llm.conversations import build_conversations, filter_low_signal
+from src.llm.packing import CONTINUATION_PREFIX, format_lines, format_message
+from src.llm.tokens import count_tokens
+
+
+def chunk_messages(messages: List[Dict], max_tokens: int, model: str = None,
+                   keep_ids: Set[int] = frozenset()) -> List[str]:
+    """
+    Упаковывает разговоры (ветки ответов и сессии) в чанки не длиннее max_tokens.
+    Разговор, не помещающийся в один чанк, режется по времени; одиночные
+    короткие реплики без реакции отбрасываются, кроме сообщений из keep_ids.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append('\n'.join(current))
+        current, current_tokens = [], 0
+
+    for conv in filter_low_signal(build_conversations(messages), keep_ids=keep_ids):
+        lines = format_lines(conv.messages, model)
+        tokens = [count_tokens(line, model) + 1 for line in lines]
+        # Целый разговор не влезает в остаток чанка — начинаем новый
+        if current and current_tokens + sum(tokens) > max_tokens:
+            flush()
+        for msg, line, line_tokens in zip(conv.messages, lines, tokens):
+            if current and current_tokens + line_tokens > max_tokens:
+                flush()
+            # Новый чанк не должен начинаться с реплики без ника
+            if not current and line.startswith(CONTINUATION_PREFIX):
+                line = format_message(msg, model)
+            current.append(line)
+            current_tokens += line_tokens
+    flush()
+    return chunks
@@ -1,33 +1,83 @@
-from typing import Optional, List, Dict
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Tuple
+import asyncio
+import json
 import logging
+import httpx
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_openai import ChatOpenAI
-from langchain_ollama import ChatOllama
 from src.config.config import load_config
-from src.llm.prompts import SYSTEM_PROMPT
-from src.llm.vector_store import MessageVectorStore
+from src.llm.chunking import chunk_messages
+from src.llm.embeddings import close_embedding_backend
+from src.llm.dedup import dedup_messages
+from src.llm.conversations import (build_conversations, filter_low_signal, hit_ranks, must_include,
+                                   rank_conversations, select_conversations)
+from src.llm.packing import pack_conversations
+from src.llm.prompts import SYSTEM_PROMPT, REDUCE_PROMPT
+from src.llm.router import Target, get_router, route_targets
+from src.llm.tokens import count_tokens
 from src.config.schemas import LLMResponse
+from src.metrics.metrics import incr, stage
+from src.storage.llm_cache import get_llm_cache, make_key
 
 config = load_config()
 LLM_CONFIG = config['LLM_CONFIG']
 RAG_CONFIG = config['RAG_CONFIG']
 
+# Выполняющиеся запросы к LLM по ключу кэша — для дедупликации одинаковых вызовов
+_inflight: Dict[str, asyncio.Future] = {}
+# Готовые LangChain-объекты по (провайдер, модель, base_url, температура)
+_runnables: Dict[tuple, object] = {}
+_http_client: Optional[httpx.AsyncClient] = None
 
-def get_langchain_llm(model: Optional[str] = None):
-    """Возвращает LangChain LLM-объект в зависимости от провайдера с поддержкой JSON-формата."""
-    provider = LLM_CONFIG['provider']
+
+class NoMessagesError(Exception):
+    """После схлопывания дубликатов и отсева шума в окне не осталось сообщений для отчёта."""
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Общий пул HTTP-соединений с keep-alive для всех LLM-клиентов OpenAI-совместимых API."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_CONFIG['http_max_connections'],
+                max_keepalive_connections=LLM_CONFIG['http_max_connections'],
+            ),
+            timeout=httpx.Timeout(LLM_CONFIG['timeout'], connect=10.0),
+        )
+    return _http_client
+
+
+def get_langchain_llm(model: Optional[str] = None, provider: Optional[str] = None):
+    """
+    Возвращает LangChain LLM-объект в зависимости от провайдера с поддержкой JSON-формата.
+    Объекты кэшируются по (провайдер, модель, base_url, температура) и переиспользуют HTTP-соединения.
+    """
+    provider = provider or LLM_CONFIG['provider']
     model_name = model or LLM_CONFIG['model']
-    base_url = LLM_CONFIG.get('base_url')
+    # LLM_BASE_URL относится к основному провайдеру; резервные другого провайдера идут на адрес по умолчанию
+    base_url = LLM_CONFIG.get('base_url') if provider == LLM_CONFIG['provider'] else None
+    key = (provider, model_name, base_url, LLM_CONFIG['temperature'])
+    runnable = _runnables.get(key)
+    if runnable is None:
+        runnable = _runnables[key] = build_langchain_llm(provider, model_name, base_url)
+    return runnable
+
+
+def build_langchain_llm(provider: str, model_name: str, base_url: Optional[str] = None):
     api_key = LLM_CONFIG.get('api_key')
     output_parser = JsonOutputParser(pydantic_object=LLMResponse)
 
+    # Провайдеры импортируются лениво: нужен только выбранный
     if provider == 'openai':
+        from langchain_openai import ChatOpenAI
         llm = ChatOpenAI(
             api_key=api_key,
             base_url=base_url,
             model=model_name,
-            temperature=0.2,
+            temperature=LLM_CONFIG['temperature'],
+            http_async_client=get_http_client(),
         )
         try:
             # Пробуем использовать with_structured_output для моделей, поддерживающих JSON Schema
@@ -37,10 +87,12 @@ def get_langchain_llm(model: Optional[str] = None):
                 f"with_structured_output not supported for {model_name}: {e}. Falling back to JsonOutputParser.")
             return llm | output_parser
     elif provider == 'ollama':
+        from langchain_ollama import ChatOllama
+        # Клиент Ollama создаётся один раз на объект ChatOllama и держит своё соединение
         llm = ChatOllama(
             base_url=base_url or 'http://localhost:11434',
             model=model_name,
-            temperature=0.2,
+            temperature=LLM_CONFIG['temperature'],
         )
         # Для Ollama всегда используем JsonOutputParser с промптом
         return llm | output_parser
@@ -48,29 +100,215 @@ def get_langchain_llm(model: Optional[str] = None):
         raise ValueError(f"Unknown LLM provider: {provider}")
 
 
-async def summarize(messages: List[Dict], model: str = None) -> Dict:
-    """Разбивает сообщения на чанки, суммаризирует их и формирует объект с необходимыми темами."""
+async def close_llm_clients():
+    """Закрывает общие HTTP-соединения LLM и эмбеддингов (при завершении процесса)."""
+    global _http_client
+    _runnables.clear()
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+    await close_embedding_backend()
+
+
+async def summarize(messages: List[Dict], model: str = None, chat_id=None,
+                    queries: Optional[List[str]] = None, top_k: Optional[int] = None) -> Dict:
+    """Формирует отчёт по сообщениям в режиме LLM_CONFIG['summary_mode'] (rag или map_reduce)."""
+    if LLM_CONFIG['summary_mode'] == 'map_reduce':
+        return await summarize_map_reduce(messages, model)
+    return await summarize_rag(messages, model, chat_id, queries, top_k)
+
+
+async def summarize_rag(messages: List[Dict], model: str = None, chat_id=None,
+                        queries: Optional[List[str]] = None, top_k: Optional[int] = None) -> Dict:
+    """
+    Выбирает RAG-поиском релевантные сообщения и суммаризирует их одним запросом.
+    queries и top_k переопределяют RAG_CONFIG для конкретной задачи.
+    """
+    # faiss и numpy нужны только RAG-режиму
+    from src.llm.retrieval import retrieve
+    from src.llm.vector_store import MessageVectorStore, get_vector_store
+
+    top_k = top_k or RAG_CONFIG['top_k']
+    keep_ids = {msg['id'] for msg in must_include(messages)}
+    # Почти-дубликаты схлопываются, шум отбрасывается — ни в индекс, ни в промпт они не идут
+    messages = dedup_messages(messages, keep_ids=keep_ids)
+    if not messages:
+        logging.error("Ошибка в RAG summarize: после отсева шума не осталось сообщений")
+        raise NoMessagesError("Нет сообщений для анализа")
     # --- RAG: Индексация и поиск релевантных сообщений ---
-    vector_store = MessageVectorStore()
-    await vector_store.add_messages(messages)
-    query = RAG_CONFIG['query']
-    query_emb = await vector_store.get_query_embedding(query)
-    relevant_messages = vector_store.search(query_emb, top_k=RAG_CONFIG['top_k'])
+    if chat_id is None:
+        vector_store = MessageVectorStore()
+        await vector_store.add_messages(messages)
+        window_ids = None
+    else:
+        # Персистентный индекс чата: дообучаем новыми сообщениями и ищем только в окне отчёта
+        vector_store = get_vector_store(chat_id)
+        async with vector_store.lock:
+            removed = vector_store.prune(datetime.now() - timedelta(days=RAG_CONFIG['retention_days']))
+            await vector_store.add_messages(messages)
+            vector_store.save()
+        logging.info(f'Индекс чата {chat_id}: {len(vector_store.messages)} сообщений, удалено устаревших: {removed}')
+        window_ids = [msg['id'] for msg in messages]
+    relevant_messages = await retrieve(vector_store, messages, top_k, ids=window_ids, queries=queries)
     if not relevant_messages:
         error_message = "Нет релевантных сообщений для анализа"
         logging.error(f"Ошибка в RAG summarize: {error_message}")
-        raise Exception(error_message)
-    payload = "\n".join([f"{msg.get('username', 'Anonymous')}: {msg.get('text', '')}" for msg in relevant_messages])
-    return await llm_call(model or LLM_CONFIG.get('model', 'gpt-3.5-turbo'), SYSTEM_PROMPT, payload)
+        raise NoMessagesError(error_message)
+    # Отдаём в LLM не отдельные реплики, а разговоры целиком
+    conversations = filter_low_signal(build_conversations(messages), keep_ids=keep_ids)
+    selected = select_conversations(rank_conversations(conversations, relevant_messages),
+                                    relevant_messages, top_k, keep_ids)
+    logging.info(f'RAG: {len(relevant_messages)} найденных сообщений → {len(selected)} разговоров, '
+                 f'{sum(len(conv.messages) for conv in selected)} сообщений в промпте')
+    model = model or LLM_CONFIG.get('model', 'gpt-3.5-turbo')
+    payload, _ = pack_conversations(selected, model=model, ranks=hit_ranks(relevant_messages), keep_ids=keep_ids)
+    if not payload:
+        error_message = "Ни один разговор не поместился в LLM_CONTEXT_BUDGET"
+        logging.error(f"Ошибка в RAG summarize: {error_message}")
+        raise NoMessagesError(error_message)
+    return await llm_call(model, SYSTEM_PROMPT, payload)
+
+
+async def summarize_map_reduce(messages: List[Dict], model: str = None) -> Dict:
+    """
+    Иерархическая суммаризация всей переписки: сообщения режутся на чанки по токенам,
+    чанки суммаризируются параллельно, частичные отчёты сводятся REDUCE_PROMPT
+    в один или несколько раундов.
+    """
+    model = model or LLM_CONFIG.get('model', 'gpt-3.5-turbo')
+    # Хэштеги и поздравления не должны пропасть ни при схлопывании дубликатов, ни как одиночные реплики
+    keep_ids = {msg['id'] for msg in must_include(messages)}
+    chunks = chunk_messages(dedup_messages(messages, keep_ids=keep_ids), LLM_CONFIG['chunk_tokens'], model,
+                            keep_ids=keep_ids)
+    if not chunks:
+        error_message = "Нет сообщений для анализа"
+        logging.error(f"Ошибка в map-reduce summarize: {error_message}")
+        raise NoMessagesError(error_message)
+    semaphore = asyncio.Semaphore(LLM_CONFIG['concurrency'])
+
+    async def bounded_call(prompt: str, content: str) -> Dict:
+        async with semaphore:
+            return await llm_call(model, prompt, content)
+
+    logging.info(f'Map-reduce: {len(messages)} сообщений в {len(chunks)} чанках')
+    partials = await asyncio.gather(*(bounded_call(SYSTEM_PROMPT, chunk) for chunk in chunks))
+    return await reduce_partials(list(partials), bounded_call, model)
+
 
+async def reduce_partials(partials: List[Dict], call, model: str) -> Dict:
+    """Сводит частичные отчёты: группы, влезающие в бюджет чанка, объединяются, пока не останется один."""
+    round_number = 0
+    while len(partials) > 1:
+        round_number += 1
+        groups: List[List[str]] = [[]]
+        group_tokens = 0
+        for partial in partials:
+            serialized = json.dumps(partial, ensure_ascii=False)
+            tokens = count_tokens(serialized, model)
+            # В группе должно быть хотя бы два отчёта, иначе сведение не продвинется
+            if len(groups[-1]) >= 2 and group_tokens + tokens > LLM_CONFIG['chunk_tokens']:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(serialized)
+            group_tokens += tokens
+        logging.info(f'Reduce, раунд {round_number}: {len(partials)} частичных отчётов в {len(groups)} группах')
+        partials = list(await asyncio.gather(*(
+            call(REDUCE_PROMPT, '[\n' + ',\n'.join(group) + '\n]') for group in groups
+        )))
+    return partials[0]
 
-async def llm_call(model: str, prompt: str, content: str):
-    """Универсальный вызов LLM через LangChain."""
-    llm = get_langchain_llm(model)
+
+async def merge_reports(partials: List[Dict], model: str = None) -> Dict:
+    """Сводит готовые частичные отчёты (например, дневные) в один через REDUCE_PROMPT."""
+    if not partials:
+        raise Exception("Нет частичных отчётов для сведения")
+    model = model or LLM_CONFIG.get('model', 'gpt-3.5-turbo')
+    semaphore = asyncio.Semaphore(LLM_CONFIG['concurrency'])
+
+    async def bounded_call(prompt: str, content: str) -> Dict:
+        async with semaphore:
+            return await llm_call(model, prompt, content)
+
+    logging.info(f'Сведение {len(partials)} частичных отчётов')
+    return await reduce_partials(list(partials), bounded_call, model)
+
+
+async def llm_call(model: str, prompt: str, content: str, cache_mode: Optional[str] = None):
+    """
+    Универсальный вызов LLM через LangChain с кэшем ответов.
+
+    cache_mode (по умолчанию LLM_CACHE_MODE): on — брать из кэша, refresh — запросить
+    заново и перезаписать кэш, off — не использовать кэш. Ответ кэшируется под ключом
+    цели, которая его дала; при поиске ответ основной модели предпочтительнее ответов
+    резервных. Одновременные одинаковые запросы (on/refresh) делят один вызов модели.
+    """
+    model = model or LLM_CONFIG['model']
+    cache_mode = cache_mode or LLM_CONFIG['cache_mode']
+    if cache_mode == 'off':
+        return await invoke_llm(model, prompt, content)
+
+    targets = route_targets(model)
+    key = target_cache_key(targets[0], prompt, content)
+    if cache_mode == 'on':
+        for target in targets:
+            cached = get_llm_cache().get(target_cache_key(target, prompt, content))
+            if cached is not None:
+                logging.info(f'Ответ LLM {target.name} взят из кэша')
+                incr('llm_cache_hits')
+                return cached
+        incr('llm_cache_misses')
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_invoke_and_cache(model, prompt, content))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        incr('llm_inflight_shared')
+    # shield: отмена одного ожидающего не должна отменять общий запрос
+    return await asyncio.shield(task)
+
+
+def target_cache_key(target: Target, prompt: str, content: str) -> str:
+    return make_key(target.provider, target.model, LLM_CONFIG['temperature'], prompt, content,
+                    LLMResponse.model_json_schema())
+
+
+async def _invoke_and_cache(model: str, prompt: str, content: str):
+    target, response = await invoke_routed(model, prompt, content)
+    get_llm_cache().put(target_cache_key(target, prompt, content), response)
+    return response
+
+
+async def invoke_llm(model: str, prompt: str, content: str):
+    """
+    Вызов модели без кэша через маршрутизатор: основная модель, при ошибке или
+    медленном ответе — резервные из LLM_FALLBACKS. Ответ должен проходить схему LLMResponse.
+    """
+    _, response = await invoke_routed(model, prompt, content)
+    return response
+
+
+async def invoke_routed(model: str, prompt: str, content: str) -> Tuple[Target, Dict]:
+    """Как invoke_llm, но возвращает и цель, которая дала ответ."""
     messages = [SystemMessage(content=prompt), HumanMessage(content=content)]
+
+    async def call(target: Target) -> Tuple[Target, Dict]:
+        llm = get_langchain_llm(target.model, target.provider)
+        with stage('llm_call', items=1) as handle:
+            handle.bytes = len(prompt.encode('utf-8')) + len(content.encode('utf-8'))
+            response = await llm.ainvoke(messages)
+        response = response.dict() if hasattr(response, 'dict') else response
+        # Невалидный ответ — ошибка цели: запрос уходит следующей
+        LLMResponse.model_validate(response)
+        # Оценка по токенизатору: структурированный вывод LangChain не возвращает usage
+        incr('llm_prompt_tokens', count_tokens(prompt, target.model) + count_tokens(content, target.model))
+        incr('llm_completion_tokens', count_tokens(json.dumps(response, ensure_ascii=False), target.model))
+        return target, response
+
+    router = get_router()
     try:
-        response = await llm.ainvoke(messages)
-        return response.dict() if hasattr(response, 'dict') else response
+        return await router.run(route_targets(model), call)
     except Exception as e:
-        logging.error(f"Ошибка при вызове LLM: {e}")
+        logging.error(f"Ошибка при вызове LLM: {e}; состояние целей: {router.snapshot()}")
         raise Exception(f"Не удалось получить валидный JSON-ответ: {e}")
@@ -0,0 +1,190 @@
+"""
+Восстановление веток ответов и кластеризация переписки в разговоры.
+
+Разговор — сессия, выделенная по паузам между сообщениями и ограниченная по длительности,
+вместе с деревьями ответов на её сообщения. Ответ попадает только в разговор родителя,
+поэтому сессии не склеиваются через ответы. Всё строится за линейное время по индексу
+id → сообщение.
+"""
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Sequence, Set
+
+from src.config.config import load_config
+
+config = load_config()
+RAG_CONFIG = config['RAG_CONFIG']
+HASHTAGS = config['HASHTAGS']
+
+MUST_INCLUDE_PATTERN = re.compile(RAG_CONFIG['must_include_pattern'], re.IGNORECASE) \
+    if RAG_CONFIG['must_include_pattern'] else None
+HASHTAG_PATTERN = re.compile(
+    r'#(?:' + '|'.join(re.escape(tag) for tag in HASHTAGS) + r')\b', re.IGNORECASE
+) if HASHTAGS else None
+
+
+def must_include(messages: Sequence[Dict]) -> List[Dict]:
+    """Сообщения, которые нельзя пропускать: хэштеги из HASHTAGS и поздравления."""
+    result = []
+    for msg in messages:
+        text = f"{msg.get('text', '')} {msg.get('caption', '')}"
+        if (HASHTAG_PATTERN and HASHTAG_PATTERN.search(text)) or \
+                (MUST_INCLUDE_PATTERN and MUST_INCLUDE_PATTERN.search(text)):
+            result.append(msg)
+    return result
+
+
+@dataclass
+class Conversation:
+    messages: List[Dict] = field(default_factory=list)
+
+    @property
+    def ids(self) -> List[int]:
+        return [msg['id'] for msg in self.messages]
+
+    def is_low_signal(self, max_chars: int) -> bool:
+        """Одиночная короткая реплика без ответов, ссылок и вложений."""
+        if len(self.messages) > 1:
+            return False
+        msg = self.messages[0]
+        text = msg.get('text', '')
+        return (len(text) <= max_chars and '#' not in text
+                and not msg.get('links') and not msg.get('media_type'))
+
+
+class DisjointSet:
+    def __init__(self):
+        self.parent: Dict[int, int] = {}
+
+    def add(self, item: int):
+        self.parent.setdefault(item, item)
+
+    def find(self, item: int) -> int:
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Сжатие путей
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # Корнем делаем более раннее сообщение
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def build_conversations(messages: Sequence[Dict], gap_minutes: int = None,
+                        max_minutes: int = None) -> List[Conversation]:
+    """
+    Кластеризует сообщения (в хронологическом порядке) в разговоры: ответ попадает
+    в разговор родителя, а остальное сообщение, отправленное не позже gap_minutes после
+    предыдущего, — в его сессию, если сессия длится не дольше max_minutes.
+    Разговоры упорядочены по первому сообщению.
+    """
+    gap_seconds = (gap_minutes if gap_minutes is not None else RAG_CONFIG['conversation_gap_minutes']) * 60
+    max_seconds = (max_minutes if max_minutes is not None else RAG_CONFIG['conversation_max_minutes']) * 60
+    groups = DisjointSet()
+    previous_id, previous_ts, session_start = None, None, None
+    for msg in messages:
+        msg_id = msg['id']
+        groups.add(msg_id)
+        parent = msg.get('reply_to')
+        if parent in groups.parent:
+            # Ответ не продолжает сессию: иначе в оживлённом чате все сессии сцепляются в одну
+            groups.union(msg_id, parent)
+            continue
+        ts = datetime.fromisoformat(msg['date']).timestamp()
+        if previous_id is not None and ts - previous_ts <= gap_seconds and ts - session_start <= max_seconds:
+            groups.union(msg_id, previous_id)
+        else:
+            session_start = ts
+        previous_id, previous_ts = msg_id, ts
+
+    conversations: Dict[int, Conversation] = {}
+    for msg in messages:
+        conversations.setdefault(groups.find(msg['id']), Conversation()).messages.append(msg)
+    return list(conversations.values())
+
+
+def filter_low_signal(conversations: List[Conversation], max_chars: int = None,
+                      keep_ids: Set[int] = frozenset()) -> List[Conversation]:
+    """Отбрасывает одиночные короткие реплики, которые никто не подхватил (кроме сообщений из keep_ids)."""
+    max_chars = max_chars if max_chars is not None else RAG_CONFIG['low_signal_max_chars']
+    return [
+        conv for conv in conversations
+        if not conv.is_low_signal(max_chars) or conv.messages[0]['id'] in keep_ids
+    ]
+
+
+def rank_conversations(conversations: List[Conversation], hits: List[Dict]) -> List[Conversation]:
+    """
+    Ранжирует разговоры по найденным поиском сообщениям (hits упорядочены по релевантности):
+    вклад сообщения — 1 / (ранг + 1), разговоры без попаданий отбрасываются.
+    """
+    by_message: Dict[int, int] = {}
+    for i, conv in enumerate(conversations):
+        for msg_id in conv.ids:
+            by_message[msg_id] = i
+    scores: Dict[int, float] = {}
+    for rank, msg in enumerate(hits):
+        conv_index = by_message.get(msg['id'])
+        if conv_index is not None:
+            scores[conv_index] = scores.get(conv_index, 0.0) + 1.0 / (rank + 1)
+    ranked = sorted(scores, key=lambda i: scores[i], reverse=True)
+    return [conversations[i] for i in ranked]
+
+
+def trim_conversation(conv: Conversation, hit_ranks: Dict[int, int], max_messages: int,
+                      keep_ids: Set[int] = frozenset()) -> Conversation:
+    """
+    Из слишком длинного разговора оставляет max_messages сообщений по приоритету: сначала
+    из keep_ids, затем найденные по рангу релевантности, затем их родители и прямые ответы
+    на них (в порядке ранга найденного). Оставшиеся сообщения идут в хронологическом порядке.
+    """
+    if len(conv.messages) <= max_messages:
+        return conv
+    by_id = {msg['id']: msg for msg in conv.messages}
+    replies: Dict[int, List[int]] = {}
+    for msg in conv.messages:
+        replies.setdefault(msg.get('reply_to'), []).append(msg['id'])
+    hits = sorted((msg_id for msg_id in by_id if msg_id in hit_ranks), key=hit_ranks.get)
+    priority = [msg_id for msg_id in by_id if msg_id in keep_ids] + hits
+    for msg_id in hits:
+        priority.append(by_id[msg_id].get('reply_to'))
+        priority.extend(replies.get(msg_id, ()))
+    kept: Set[int] = set()
+    for msg_id in priority:
+        if len(kept) >= max_messages:
+            break
+        if msg_id in by_id:
+            kept.add(msg_id)
+    return Conversation([msg for msg in conv.messages if msg['id'] in kept])
+
+
+def hit_ranks(hits: List[Dict]) -> Dict[int, int]:
+    """Ранг каждого найденного сообщения (hits упорядочены по релевантности)."""
+    ranks: Dict[int, int] = {}
+    for rank, msg in enumerate(hits):
+        ranks.setdefault(msg['id'], rank)
+    return ranks
+
+
+def select_conversations(ranked: List[Conversation], hits: List[Dict], max_messages: int,
+                         keep_ids: Set[int] = frozenset()) -> List[Conversation]:
+    """
+    Берёт лучшие разговоры целиком, пока суммарно не наберётся max_messages сообщений;
+    не помещающиеся в остаток сокращает trim_conversation. Порядок — по убыванию релевантности.
+    """
+    ranks = hit_ranks(hits)
+    selected: List[Conversation] = []
+    total = 0
+    for conv in ranked:
+        if total >= max_messages:
+            break
+        conv = trim_conversation(conv, ranks, max_messages - total, keep_ids)
+        selected.append(conv)
+        total += len(conv.messages)
+    return selected
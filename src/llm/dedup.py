@@ -0,0 +1,158 @@
+"""
+Схлопывание почти-дубликатов и отсев шума перед эмбеддингом и промптом.
+
+Копипасты, повторяющиеся уведомления CI/ботов и реплики вида «+1» не несут новой
+информации, но тратят эмбеддинги и занимают места в top-k. Для каждого сообщения
+считается 64-битный SimHash по шинглам нормализованного текста; кандидаты в дубликаты
+ищутся LSH-индексом по полосам отпечатка (сообщения с расстоянием Хэмминга не больше
+max_distance гарантированно совпадают хотя бы в одной полосе). Дубликаты схлопываются
+в первое увиденное сообщение, у которого растёт repeat_count.
+"""
+import hashlib
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from src.config.config import load_config
+from src.metrics.metrics import incr
+
+config = load_config()
+RAG_CONFIG = config['RAG_CONFIG']
+
+NOISE_PATTERN = re.compile(RAG_CONFIG['noise_pattern'], re.IGNORECASE)
+URL_PATTERN = re.compile(r'https?://(\S+?)(?:/\S*)?(?=\s|$)')
+NUMBER_PATTERN = re.compile(r'\d+')
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def normalize_text(text: str) -> str:
+    """Приводит текст к виду, в котором уведомления с разными номерами сборок и ссылками совпадают."""
+    text = URL_PATTERN.sub(r'\1', text.lower())
+    return NUMBER_PATTERN.sub('0', text)
+
+
+def shingles(text: str, size: int) -> List[str]:
+    words = WORD_PATTERN.findall(normalize_text(text))
+    if len(words) <= size:
+        return [' '.join(words)] if words else []
+    return [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def _hash64(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def simhash(text: str, shingle_size: Optional[int] = None) -> Optional[int]:
+    """64-битный SimHash текста; None для текста без слов."""
+    tokens = shingles(text, shingle_size or RAG_CONFIG['dedup_shingle_size'])
+    if not tokens:
+        return None
+    hashes = np.array([_hash64(token) for token in tokens], dtype=np.uint64)
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(len(tokens), 64)
+    # Бит отпечатка — голос большинства шинглов
+    fingerprint = np.packbits(bits.sum(axis=0) * 2 > len(tokens))
+    return int.from_bytes(fingerprint.tobytes(), 'big')
+
+
+def is_noise(msg: Dict) -> bool:
+    """Реплика без информации («+1», «ок», эмодзи) без ссылок, вложений и хэштегов."""
+    text = msg.get('text', '')
+    if msg.get('links') or msg.get('media_type') or '#' in text:
+        return False
+    return NOISE_PATTERN.fullmatch(text.strip()) is not None
+
+
+class SimHashIndex:
+    """LSH-индекс отпечатков: полосы по band_bits бит → id представителей."""
+
+    def __init__(self, max_distance: Optional[int] = None):
+        self.max_distance = max_distance if max_distance is not None else RAG_CONFIG['dedup_max_distance']
+        # Полос должно быть больше max_distance, чтобы близкие отпечатки совпали хотя бы в одной
+        self.bands = next(bands for bands in (1, 2, 4, 8, 16, 32, 64) if bands > self.max_distance)
+        self.band_bits = 64 // self.bands
+        self._mask = (1 << self.band_bits) - 1
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.bands)]
+        self._fingerprints: Dict[int, int] = {}
+
+    def _band_keys(self, fingerprint: int) -> Iterable[int]:
+        return ((fingerprint >> (band * self.band_bits)) & self._mask for band in range(self.bands))
+
+    def find(self, fingerprint: int) -> Optional[int]:
+        """Возвращает id представителя на расстоянии не больше max_distance или None."""
+        for bucket, key in zip(self._buckets, self._band_keys(fingerprint)):
+            for candidate in bucket.get(key, ()):
+                if (self._fingerprints[candidate] ^ fingerprint).bit_count() <= self.max_distance:
+                    return candidate
+        return None
+
+    def add(self, item_id: int, fingerprint: int):
+        self._fingerprints[item_id] = fingerprint
+        for bucket, key in zip(self._buckets, self._band_keys(fingerprint)):
+            bucket.setdefault(key, []).append(item_id)
+
+
+class Deduplicator:
+    """
+    Потоковый фильтр: accept() решает, нужно ли сообщение дальше (эмбеддинг, промпт).
+    Первое сообщение кластера становится представителем, остальные увеличивают его repeat_count.
+    """
+
+    def __init__(self, max_distance: Optional[int] = None, keep_ids: Set[int] = frozenset()):
+        self.index = SimHashIndex(max_distance)
+        self.keep_ids = keep_ids
+        self.representatives: Dict[int, Dict] = {}
+        # id дубликата → id представителя
+        self.aliases: Dict[int, int] = {}
+        self.duplicates = 0
+        self.noise = 0
+
+    def accept(self, msg: Dict) -> bool:
+        msg_id = msg['id']
+        if msg_id in self.keep_ids:
+            return True
+        if is_noise(msg):
+            self.noise += 1
+            return False
+        fingerprint = simhash(msg.get('text', '') + ' ' + msg.get('caption', ''))
+        if fingerprint is None:
+            return True
+        representative_id = self.index.find(fingerprint)
+        if representative_id is not None:
+            representative = self.representatives[representative_id]
+            representative['repeat_count'] = representative.get('repeat_count', 1) + 1
+            self.aliases[msg_id] = representative_id
+            self.duplicates += 1
+            return False
+        self.index.add(msg_id, fingerprint)
+        self.representatives[msg_id] = msg
+        return True
+
+    def report(self):
+        incr('dedup_duplicates', self.duplicates)
+        incr('dedup_noise', self.noise)
+
+
+def dedup_messages(messages: List[Dict], keep_ids: Set[int] = frozenset()) -> List[Dict]:
+    """
+    Схлопывает почти-дубликаты и убирает шум в сообщениях окна (в хронологическом порядке).
+
+    Как и при загрузке, представителем становится самое новое сообщение кластера — тогда оно
+    уже есть в индексе чата. Ответы на схлопнутые более ранние копии перевешиваются на
+    представителя, если он не позже ответа. Входные словари не меняются.
+    """
+    if not RAG_CONFIG['dedup']:
+        return messages
+    deduplicator = Deduplicator(keep_ids=keep_ids)
+    kept = []
+    for msg in reversed(messages):
+        msg = dict(msg)
+        if deduplicator.accept(msg):
+            kept.append(msg)
+    kept.reverse()
+    for msg in kept:
+        representative_id = deduplicator.aliases.get(msg.get('reply_to'))
+        if representative_id is not None and representative_id < msg['id']:
+            msg['reply_to'] = representative_id
+    deduplicator.report()
+    return kept
@@ -0,0 +1,198 @@
+"""
+Пакетное получение эмбеддингов через подключаемые бэкенды.
+
+Бэкенд выбирается RAG_PROVIDER:
+  openai — OpenAI-совместимый API: входы делятся на батчи по числу элементов и оценке
+           токенов, батчи выполняются параллельно (не более RAG_CONCURRENCY одновременно)
+           с повторами при 429/5xx;
+  local  — модель sentence-transformers в процессе (CPU/GPU): батчи считаются в пуле
+           потоков, чтобы не блокировать event loop, без сетевых задержек и оплаты за токены.
+Результаты всегда возвращаются в исходном порядке.
+"""
+import asyncio
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI, RateLimitError
+
+from src.config.config import load_config
+from src.llm.tokens import count_tokens, truncate_tokens
+from src.metrics.metrics import incr
+
+config = load_config()
+RAG_CONFIG = config['RAG_CONFIG']
+RAG_PROVIDER = RAG_CONFIG['provider']
+RAG_MODEL = RAG_CONFIG['model']
+
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+
+def make_batches(texts: List[str], max_items: int, max_tokens: int) -> List[List[int]]:
+    """
+    Делит тексты на батчи индексов так, чтобы в батче было не больше max_items
+    элементов и не больше max_tokens токенов (одиночный большой текст идёт отдельным батчем).
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text, RAG_MODEL)
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Задержка перед повтором: Retry-After от провайдера или экспонента с джиттером."""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY) * (0.5 + random.random() / 2)
+
+
+class OpenAIEmbeddingBackend:
+    """Эмбеддинги через OpenAI-совместимый API с батчингом, параллелизмом и повторами."""
+
+    def __init__(self, model: str = RAG_MODEL, client=None):
+        self.model = model
+        # Повторы делаем сами, чтобы учитывать их в backoff и логах
+        self.client = client or AsyncOpenAI(api_key=RAG_CONFIG.get('api_key'),
+                                            base_url=RAG_CONFIG.get('base_url'), max_retries=0)
+
+    async def embed_batch(self, texts: List[str]) -> List[np.ndarray]:
+        max_retries = RAG_CONFIG['max_retries']
+        for attempt in range(max_retries + 1):
+            try:
+                response = await self.client.embeddings.create(model=self.model, input=texts)
+                incr('embedding_requests')
+                if getattr(response, 'usage', None) is not None:
+                    incr('embedding_tokens', response.usage.total_tokens)
+                data = sorted(response.data, key=lambda item: item.index)
+                return [np.array(item.embedding, dtype=np.float32) for item in data]
+            except Exception as e:
+                if attempt >= max_retries or not is_retryable(e):
+                    raise
+                delay = retry_delay(e, attempt)
+                incr('embedding_retries')
+                logging.warning(f'Ошибка эмбеддинга батча ({len(texts)} шт.): {e}. '
+                                f'Повтор {attempt + 1}/{max_retries} через {delay:.1f} с')
+                await asyncio.sleep(delay)
+
+    async def embed(self, texts: List[str]) -> List[np.ndarray]:
+        max_input_tokens = RAG_CONFIG['max_input_tokens']
+        texts = [truncate_tokens(text, max_input_tokens, self.model) for text in texts]
+        batches = make_batches(texts, RAG_CONFIG['batch_size'], RAG_CONFIG['batch_tokens'])
+        semaphore = asyncio.Semaphore(RAG_CONFIG['concurrency'])
+
+        async def run(indices: List[int]) -> List[np.ndarray]:
+            async with semaphore:
+                return await self.embed_batch([texts[i] for i in indices])
+
+        results = await asyncio.gather(*(run(indices) for indices in batches))
+        embeddings: List[np.ndarray] = [None] * len(texts)
+        for indices, vectors in zip(batches, results):
+            for i, vector in zip(indices, vectors):
+                embeddings[i] = vector
+        if len(batches) > 1:
+            logging.info(f'Эмбеддинги: {len(texts)} текстов в {len(batches)} батчах')
+        return embeddings
+
+    async def close(self):
+        await self.client.close()
+
+
+class LocalEmbeddingBackend:
+    """
+    Эмбеддинги моделью sentence-transformers в процессе. Модель загружается при первом
+    запросе; батчи по RAG_LOCAL_BATCH_SIZE считаются в пуле из RAG_LOCAL_WORKERS потоков
+    (torch отпускает GIL на время инференса).
+    """
+
+    def __init__(self, model: str = RAG_MODEL, device: str = RAG_CONFIG['local_device'],
+                 batch_size: int = RAG_CONFIG['local_batch_size'], workers: int = RAG_CONFIG['local_workers']):
+        self.model = model
+        self.device = device
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='embeddings')
+        self._encoder = None
+        self._load_lock = asyncio.Lock()
+
+    def _load(self):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError('Для RAG_PROVIDER=local установите пакет sentence-transformers') from e
+        logging.info(f'Загрузка локальной модели эмбеддингов {self.model} ({self.device})')
+        return SentenceTransformer(self.model, device=self.device)
+
+    async def _get_encoder(self):
+        async with self._load_lock:
+            if self._encoder is None:
+                loop = asyncio.get_running_loop()
+                self._encoder = await loop.run_in_executor(self._executor, self._load)
+        return self._encoder
+
+    def _encode(self, encoder, texts: List[str]) -> np.ndarray:
+        return encoder.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                              show_progress_bar=False).astype(np.float32)
+
+    async def embed(self, texts: List[str]) -> List[np.ndarray]:
+        encoder = await self._get_encoder()
+        loop = asyncio.get_running_loop()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, self._encode, encoder, batch) for batch in batches
+        ))
+        incr('embedding_requests', len(batches))
+        return [vector for matrix in results for vector in matrix]
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+
+
+BACKENDS = {'openai': OpenAIEmbeddingBackend, 'local': LocalEmbeddingBackend}
+
+_backend: Optional[object] = None
+
+
+def get_embedding_backend():
+    """Возвращает общий для процесса бэкенд эмбеддингов, выбранный RAG_PROVIDER."""
+    global _backend
+    if _backend is None:
+        if RAG_PROVIDER not in BACKENDS:
+            raise ValueError(f'Unknown RAG provider: {RAG_PROVIDER}')
+        _backend = BACKENDS[RAG_PROVIDER]()
+    return _backend
+
+
+async def close_embedding_backend():
+    global _backend
+    if _backend is not None:
+        await _backend.close()
+    _backend = None
+
+
+async def embed_texts(texts: List[str]) -> List[np.ndarray]:
+    """Возвращает эмбеддинги texts в исходном порядке."""
+    if not texts:
+        return []
+    return await get_embedding_backend().embed(texts)
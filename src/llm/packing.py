@@ -0,0 +1,135 @@
+"""
+Упаковка переписки в промпт с учётом бюджета токенов.
+
+Сообщения сжимаются (блоки кода и ссылки сворачиваются, длинные тексты обрезаются,
+подряд идущие реплики одного автора не повторяют ник), а разговоры добавляются
+в порядке релевантности, пока не исчерпан бюджет. Разговор, который не влезает
+в остаток бюджета, сокращается на наименее релевантные сообщения.
+"""
+import logging
+import re
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from src.config.config import load_config
+from src.llm.conversations import Conversation, trim_conversation
+from src.llm.tokens import count_tokens, truncate_tokens
+
+config = load_config()
+LLM_CONFIG = config['LLM_CONFIG']
+
+CODE_BLOCK_PATTERN = re.compile(r'```.*?(?:```|$)', re.DOTALL)
+URL_PATTERN = re.compile(r'https?://\S+')
+# Продолжение реплики того же автора
+CONTINUATION_PREFIX = '  ↳ '
+
+
+def _shorten_url(match: re.Match) -> str:
+    domain = urlparse(match.group(0)).netloc
+    return f'[{domain}]' if domain else '[ссылка]'
+
+
+def _elide_code(match: re.Match) -> str:
+    lines = match.group(0).count('\n') + 1
+    return f'[код, строк: {lines}]'
+
+
+def compress_text(text: str, model: Optional[str] = None, max_tokens: Optional[int] = None) -> str:
+    """Сворачивает блоки кода и ссылки, обрезает слишком длинный текст."""
+    max_tokens = max_tokens or LLM_CONFIG['max_message_tokens']
+    if '```' in text:
+        text = CODE_BLOCK_PATTERN.sub(_elide_code, text)
+    if 'http' in text:
+        text = URL_PATTERN.sub(_shorten_url, text)
+    text = ' '.join(text.split())
+    if len(text) > max_tokens and count_tokens(text, model) > max_tokens:
+        text = truncate_tokens(text, max_tokens, model) + ' […]'
+    return text
+
+
+def message_text(msg: Dict, model: Optional[str] = None) -> str:
+    """Сжатый текст сообщения; у схлопнутых дубликатов — с числом повторов."""
+    text = compress_text(msg.get('text', ''), model)
+    repeats = msg.get('repeat_count', 1)
+    return f'{text} (×{repeats})' if repeats > 1 else text
+
+
+def format_message(msg: Dict, model: Optional[str] = None) -> str:
+    """Строка сообщения для промпта: «username: текст»."""
+    return f"{msg.get('username', 'Anonymous')}: {message_text(msg, model)}"
+
+
+def format_lines(messages: List[Dict], model: Optional[str] = None) -> List[str]:
+    """Строки сообщений; у подряд идущих реплик одного автора ник не повторяется."""
+    lines = []
+    previous_username = None
+    for msg in messages:
+        username = msg.get('username', 'Anonymous')
+        text = message_text(msg, model)
+        lines.append(f'{CONTINUATION_PREFIX}{text}' if username == previous_username else f'{username}: {text}')
+        previous_username = username
+    return lines
+
+
+def format_conversation(conv: Conversation, model: Optional[str] = None) -> str:
+    return '\n'.join(format_lines(conv.messages, model))
+
+
+def _block_tokens(block: str, model: Optional[str]) -> int:
+    # +2 токена на разделитель между разговорами
+    return count_tokens(block, model) + 2
+
+
+def fit_conversation(conv: Conversation, budget: int, ranks: Dict[int, int], keep_ids: Set[int] = frozenset(),
+                     model: Optional[str] = None) -> Tuple[Optional[Conversation], str, int]:
+    """
+    Сокращает разговор (trim_conversation по рангу найденных сообщений) до наибольшего
+    числа сообщений, которое влезает в budget токенов. Возвращает разговор, его текст
+    и число токенов; (None, '', 0), если не влезает даже одно сообщение.
+    """
+    best: Tuple[Optional[Conversation], str, int] = (None, '', 0)
+    low, high = 1, len(conv.messages) - 1
+    # Число токенов монотонно по числу оставленных сообщений — ищем границу бинарным поиском
+    while low <= high:
+        middle = (low + high) // 2
+        trimmed = trim_conversation(conv, ranks, middle, keep_ids)
+        block = format_conversation(trimmed, model)
+        tokens = _block_tokens(block, model)
+        if tokens <= budget:
+            best = (trimmed, block, tokens)
+            low = middle + 1
+        else:
+            high = middle - 1
+    return best
+
+
+def pack_conversations(ranked: List[Conversation], budget: Optional[int] = None,
+                       model: Optional[str] = None, ranks: Optional[Dict[int, int]] = None,
+                       keep_ids: Set[int] = frozenset()) -> Tuple[str, int]:
+    """
+    Заполняет бюджет токенов разговорами в порядке релевантности; не поместившийся
+    разговор сокращается на наименее релевантные сообщения (ranks — ранги найденных,
+    keep_ids остаются первыми). В промпт разговоры идут в хронологическом порядке.
+    Возвращает текст и число использованных токенов.
+    """
+    budget = budget or LLM_CONFIG['context_budget']
+    ranks = ranks or {}
+    packed: List[Tuple[Conversation, str]] = []
+    used = 0
+    trimmed = 0
+    skipped = 0
+    for conv in ranked:
+        block = format_conversation(conv, model)
+        tokens = _block_tokens(block, model)
+        if used + tokens > budget:
+            conv, block, tokens = fit_conversation(conv, budget - used, ranks, keep_ids, model)
+            if conv is None:
+                skipped += 1
+                continue
+            trimmed += 1
+        packed.append((conv, block))
+        used += tokens
+    packed.sort(key=lambda item: item[0].messages[0]['date'])
+    logging.info(f'Промпт: {used} из {budget} токенов, разговоров {len(packed)}, '
+                 f'сообщений {sum(len(conv.messages) for conv, _ in packed)}, сокращено {trimmed}, не поместилось {skipped}')
+    return '\n\n'.join(block for _, block in packed), used
@@ -86,3 +86,10 @@ REPORT_PROMPT = (
     # "## 🔥 Пример (не используй в ответе):\n"
     # f'{EXAMPLE_RESPONSE}'
 )
+
+# Промпт для reduce-шага map-reduce: объединяет частичные отчёты в итоговый
+REDUCE_PROMPT = (
+    f'{REPORT_PROMPT}'
+    "## 📦 Формат вывода:\n"
+    f'{EXAMPLE_RESPONSE_FORMAT}'
+)
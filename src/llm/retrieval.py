@@ -0,0 +1,141 @@
+"""
+Гибридный поиск релевантных сообщений: несколько запросов, векторный поиск + BM25,
+слияние через reciprocal rank fusion, MMR для разнообразия и обязательное включение
+сообщений с хэштегами и ключевыми словами.
+"""
+import logging
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src.config.config import load_config
+from src.llm.conversations import must_include
+from src.llm.vector_store import MessageVectorStore, to_matrix
+from src.metrics.metrics import stage
+
+config = load_config()
+RAG_CONFIG = config['RAG_CONFIG']
+
+# Константа сглаживания RRF из оригинальной статьи
+RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Простой BM25 по тем же сообщениям, что и векторный индекс."""
+
+    def __init__(self, messages: Sequence[Dict]):
+        self.messages = list(messages)
+        self.doc_freqs: List[Counter] = []
+        self.doc_lens: List[int] = []
+        df: Counter = Counter()
+        for msg in self.messages:
+            tokens = tokenize(f"{msg.get('text', '')} {msg.get('caption', '')}")
+            freqs = Counter(tokens)
+            self.doc_freqs.append(freqs)
+            self.doc_lens.append(len(tokens))
+            df.update(freqs.keys())
+        n = len(self.messages)
+        self.avg_len = sum(self.doc_lens) / n if n else 0.0
+        self.idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def search(self, query: str, top_k: int) -> List[Dict]:
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        if not terms:
+            return []
+        scores = []
+        for i, freqs in enumerate(self.doc_freqs):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lens[i] / (self.avg_len or 1))
+            for term in terms:
+                tf = freqs.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            if score > 0:
+                scores.append((score, i))
+        scores.sort(reverse=True)
+        return [self.messages[i] for _, i in scores[:top_k]]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Dict]]) -> Dict[int, float]:
+    """Сливает ранжированные списки: score(d) = Σ 1 / (RRF_K + rank)."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, msg in enumerate(ranking):
+            scores[msg['id']] = scores.get(msg['id'], 0.0) + 1.0 / (RRF_K + rank + 1)
+    return scores
+
+
+def mmr(candidates: List[Dict], relevance: Dict[int, float], vectors: np.ndarray,
+        top_k: int, lambda_: float, selected_vectors: Optional[np.ndarray] = None) -> List[Dict]:
+    """
+    Maximal marginal relevance: жадно выбирает кандидатов, максимизируя
+    lambda * релевантность - (1 - lambda) * максимальное сходство с уже выбранными.
+    vectors — нормированные эмбеддинги кандидатов (строки в порядке candidates).
+    """
+    if not candidates or top_k <= 0:
+        return []
+    max_relevance = max(relevance.values()) or 1.0
+    rel = np.array([relevance[msg['id']] / max_relevance for msg in candidates], dtype=np.float32)
+    # Максимальное сходство каждого кандидата с уже выбранными
+    max_sim = np.full(len(candidates), -1.0, dtype=np.float32)
+    if selected_vectors is not None and len(selected_vectors):
+        max_sim = (vectors @ selected_vectors.T).max(axis=1)
+    chosen: List[int] = []
+    available = np.ones(len(candidates), dtype=bool)
+    for _ in range(min(top_k, len(candidates))):
+        diversity = np.where(max_sim < 0, 0.0, max_sim)
+        scores = np.where(available, lambda_ * rel - (1 - lambda_) * diversity, -np.inf)
+        best = int(np.argmax(scores))
+        chosen.append(best)
+        available[best] = False
+        max_sim = np.maximum(max_sim, vectors @ vectors[best])
+    return [candidates[i] for i in chosen]
+
+
+async def retrieve(store: MessageVectorStore, messages: List[Dict], top_k: int,
+                   ids: Optional[Sequence[int]] = None, queries: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Возвращает до top_k релевантных сообщений (плюс обязательные) в порядке убывания значимости.
+    messages — сообщения окна отчёта, ids — ограничение векторного поиска этим окном.
+    """
+    queries = queries or RAG_CONFIG['queries']
+    pool = top_k * RAG_CONFIG['candidate_multiplier']
+    # Эмбеддинги всех запросов — одним батчем и через кэш эмбеддингов
+    with stage('get_query_embedding', items=len(queries)):
+        query_embeddings = await store.get_cached_embeddings(queries)
+    bm25 = BM25Index(messages)
+
+    rankings = []
+    with stage('search', items=len(queries)):
+        for query, query_emb in zip(queries, query_embeddings):
+            rankings.append(store.search(query_emb, top_k=pool, ids=ids))
+            rankings.append(bm25.search(query, pool))
+    relevance = reciprocal_rank_fusion(rankings)
+
+    by_id = {msg['id']: msg for ranking in rankings for msg in ranking}
+    required = must_include(messages)
+    required_ids = {msg['id'] for msg in required}
+    candidates = [by_id[msg_id] for msg_id in sorted(relevance, key=relevance.get, reverse=True)
+                  if msg_id not in required_ids]
+    if not candidates:
+        return required
+
+    # Вектора кандидатов берём из кэша эмбеддингов — без обращения к API
+    texts = [store._message_context(msg) for msg in candidates + required]
+    vectors = to_matrix(await store.get_cached_embeddings(texts), index_type='flat_ip')
+    selected = mmr(candidates, relevance, vectors[:len(candidates)], top_k - len(required),
+                   RAG_CONFIG['mmr_lambda'], selected_vectors=vectors[len(candidates):])
+    logging.info(f'Retrieval: {len(queries)} запросов, {len(relevance)} кандидатов, '
+                 f'обязательных {len(required)}, выбрано MMR {len(selected)}')
+    return required + selected
@@ -0,0 +1,213 @@
+"""
+Маршрутизация запросов к LLM по нескольким целям (провайдер, модель).
+
+Цели — основная из LLM_PROVIDER/LLM_MODEL и LLM_FALLBACKS. Цели с накопленной статистикой
+перебираются по ожидаемому времени до валидного ответа (p95 задержки с поправкой на долю
+ошибок за последние запросы), цели без статистики — после них в порядке конфигурации.
+У каждой цели свой таймаут и автомат-предохранитель (circuit breaker): после
+LLM_BREAKER_FAILURES ошибок подряд цель пропускается LLM_BREAKER_COOLDOWN секунд,
+после чего получает пробный запрос. При ошибке запрос сразу уходит следующей цели.
+
+С LLM_HEDGE, если ответ не пришёл за p95 задержки цели (по последним успешным запросам,
+не меньше LLM_HEDGE_MIN_DELAY), параллельно отправляется запрос следующей цели;
+побеждает первый валидный ответ, остальные отменяются. Пока у цели мало успешных
+запросов, хедж не отправляется.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from src.config.config import load_config
+from src.metrics.metrics import incr
+
+config = load_config()
+LLM_CONFIG = config['LLM_CONFIG']
+
+# Сколько последних задержек хранить и сколько нужно для оценки p95
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 10
+# Нижняя граница доли успехов в оценке цели: чтобы оценка оставалась конечной
+MIN_SUCCESS_RATE = 0.05
+
+
+@dataclass(frozen=True)
+class Target:
+    provider: str
+    model: str
+    timeout: float
+
+    @property
+    def name(self) -> str:
+        return f'{self.provider}:{self.model}'
+
+
+@dataclass
+class TargetStats:
+    """Статистика цели: задержки успешных запросов, исходы последних запросов, ошибки и состояние предохранителя."""
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+    outcomes: Deque[bool] = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+    successes: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    open_until: float = 0.0
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def error_rate(self) -> float:
+        """Доля ошибок среди последних запросов."""
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def score(self) -> Optional[float]:
+        """Ожидаемое время до валидного ответа: p95 / доля успехов; None — пока мало статистики."""
+        p95 = self.p95()
+        if p95 is None:
+            return None
+        return p95 / max(1.0 - self.error_rate(), MIN_SUCCESS_RATE)
+
+    def is_open(self, now: float) -> bool:
+        return now < self.open_until
+
+    def to_dict(self) -> Dict:
+        p95 = self.p95()
+        return {
+            'successes': self.successes,
+            'failures': self.failures,
+            'error_rate': round(self.error_rate(), 3),
+            'p95_seconds': round(p95, 3) if p95 is not None else None,
+            'breaker_open': self.is_open(time.monotonic()),
+        }
+
+
+class LLMRouter:
+    def __init__(self, hedge: bool = LLM_CONFIG['hedge'],
+                 hedge_min_delay: float = LLM_CONFIG['hedge_min_delay'],
+                 breaker_failures: int = LLM_CONFIG['breaker_failures'],
+                 breaker_cooldown: float = LLM_CONFIG['breaker_cooldown']):
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.stats: Dict[Tuple[str, str], TargetStats] = {}
+
+    def target_stats(self, target: Target) -> TargetStats:
+        key = (target.provider, target.model)
+        if key not in self.stats:
+            self.stats[key] = TargetStats()
+        return self.stats[key]
+
+    def order(self, targets: List[Target]) -> List[Target]:
+        """
+        Цели в порядке попыток: с закрытым предохранителем — по оценке score (лучшие первыми),
+        без статистики — за ними в заданном порядке; затем с открытым предохранителем —
+        по времени его закрытия (чтобы запрос не падал, даже если упали все).
+        """
+        now = time.monotonic()
+        closed = [target for target in targets if not self.target_stats(target).is_open(now)]
+        scored = sorted((target for target in closed if self.target_stats(target).score() is not None),
+                        key=lambda target: self.target_stats(target).score())
+        closed = scored + [target for target in closed if self.target_stats(target).score() is None]
+        opened = sorted((target for target in targets if self.target_stats(target).is_open(now)),
+                        key=lambda target: self.target_stats(target).open_until)
+        return closed + opened
+
+    def hedge_delay(self, target: Target) -> Optional[float]:
+        """Через сколько секунд без ответа отправлять хедж; None — пока мало статистики по цели."""
+        p95 = self.target_stats(target).p95()
+        return max(self.hedge_min_delay, p95) if p95 is not None else None
+
+    async def _attempt(self, target: Target, call: Callable[[Target], Awaitable[Dict]]) -> Dict:
+        stats = self.target_stats(target)
+        started = time.monotonic()
+        try:
+            response = await asyncio.wait_for(call(target), target.timeout)
+        except asyncio.CancelledError:
+            # Проигравший хедж-запрос — не ошибка цели
+            raise
+        except Exception as e:
+            stats.failures += 1
+            stats.outcomes.append(False)
+            stats.consecutive_failures += 1
+            incr('llm_target_failures')
+            if stats.consecutive_failures >= self.breaker_failures:
+                stats.open_until = time.monotonic() + self.breaker_cooldown
+                incr('llm_breaker_opened')
+                logging.warning(f'LLM {target.name}: {stats.consecutive_failures} ошибок подряд, '
+                                f'цель отключена на {self.breaker_cooldown:.0f} с')
+            logging.warning(f'LLM {target.name} не ответила: {type(e).__name__}: {e}')
+            raise
+        stats.latencies.append(time.monotonic() - started)
+        stats.outcomes.append(True)
+        stats.successes += 1
+        stats.consecutive_failures = 0
+        stats.open_until = 0.0
+        return response
+
+    async def run(self, targets: List[Target], call: Callable[[Target], Awaitable[Dict]]) -> Dict:
+        """
+        Выполняет call на целях до первого успешного ответа. Не больше двух запросов
+        одновременно: текущий и хедж. Если не ответила ни одна цель, пробрасывает последнюю ошибку.
+        """
+        queue = self.order(targets)
+        tasks: Dict[asyncio.Task, Target] = {}
+        last_error: Optional[BaseException] = None
+
+        def launch():
+            target = queue.pop(0)
+            tasks[asyncio.ensure_future(self._attempt(target, call))] = target
+
+        launch()
+        try:
+            while tasks:
+                delay = None
+                if self.hedge and queue and len(tasks) == 1:
+                    delay = self.hedge_delay(next(iter(tasks.values())))
+                done, _ = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    incr('llm_hedged')
+                    launch()
+                    continue
+                for task in done:
+                    target = tasks.pop(task)
+                    if task.exception() is None:
+                        if target != targets[0]:
+                            incr('llm_fallback_wins')
+                        return task.result()
+                    last_error = task.exception()
+                if not tasks and queue:
+                    incr('llm_fallbacks')
+                    launch()
+        finally:
+            for task in tasks:
+                task.cancel()
+        raise last_error
+
+    def snapshot(self) -> Dict[str, Dict]:
+        return {f'{provider}:{model}': stats.to_dict() for (provider, model), stats in self.stats.items()}
+
+
+def route_targets(model: Optional[str] = None) -> List[Target]:
+    """Основная цель (LLM_PROVIDER и model или LLM_MODEL) и резервные из LLM_FALLBACKS без повторов."""
+    targets = [Target(LLM_CONFIG['provider'], model or LLM_CONFIG['model'], LLM_CONFIG['timeout'])]
+    for fallback in LLM_CONFIG['fallbacks']:
+        target = Target(fallback['provider'], fallback['model'], fallback['timeout'])
+        if all((target.provider, target.model) != (known.provider, known.model) for known in targets):
+            targets.append(target)
+    return targets
+
+
+_router: Optional[LLMRouter] = None
+
+
+def get_router() -> LLMRouter:
+    """Возвращает общий для процесса маршрутизатор: статистика целей копится между запросами."""
+    global _router
+    if _router is None:
+        _router = LLMRouter()
+    return _router
@@ -0,0 +1,44 @@
+"""
+Подсчёт токенов через tiktoken с грубой оценкой, если токенизатор недоступен.
+"""
+import logging
+from functools import lru_cache
+from typing import Optional
+
+# Средняя длина токена для кириллицы/латиницы, используется как запасная оценка
+CHARS_PER_TOKEN = 3
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: Optional[str] = None):
+    """Возвращает токенизатор для модели (cl100k_base для неизвестных моделей) или None."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding('cl100k_base')
+    except KeyError:
+        return get_encoding(None) if model else None
+    except Exception as e:
+        # Например, нет доступа к сети для загрузки словаря
+        logging.warning(f'Не удалось загрузить токенизатор tiktoken: {e}. Используется оценка по длине.')
+        return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Обрезает текст до max_tokens токенов."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -1,39 +1,238 @@
 """
 Модуль для хранения и поиска эмбеддингов сообщений (FAISS).
 """
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
 import faiss
 import numpy as np
-from typing import List, Dict
-from openai import AsyncOpenAI
+from typing import List, Dict, Optional, Sequence
 from src.config.config import load_config
+from src.llm.embeddings import RAG_MODEL, embed_texts
+from src.metrics.metrics import incr, stage
+from src.storage.embedding_cache import get_embedding_cache, text_hash
 
 config = load_config()
 RAG_CONFIG = config['RAG_CONFIG']
-RAG_API_KEY = RAG_CONFIG.get('api_key')
-RAG_BASE_URL = RAG_CONFIG.get('base_url')
-RAG_MODEL = RAG_CONFIG.get('model', 'text-embedding-3-small')
-RAG_CLIENT = AsyncOpenAI(api_key=RAG_API_KEY, base_url=RAG_BASE_URL)
+INDEX_TYPE = RAG_CONFIG['index_type']
+
+INDEX_TYPES = ('flat_l2', 'flat_ip', 'hnsw', 'ivf_flat', 'ivf_pq')
+IVF_TYPES = ('ivf_flat', 'ivf_pq')
+# Для IVF faiss рекомендует не меньше 39 обучающих векторов на кластер
+IVF_POINTS_PER_CENTROID = 39
+# PQ с 8-битными кодами требует минимум 256 обучающих векторов
+PQ_MIN_TRAIN = 256
+
+
+def uses_cosine(index_type: str = INDEX_TYPE) -> bool:
+    """Все типы индексов, кроме flat_l2, работают по косинусу (скалярное произведение нормированных векторов)."""
+    return index_type != 'flat_l2'
+
+
+def to_matrix(embeddings: Sequence[np.ndarray], index_type: str = INDEX_TYPE) -> np.ndarray:
+    """Собирает эмбеддинги в непрерывную float32-матрицу (нормированную для косинусных индексов)."""
+    matrix = np.ascontiguousarray(np.vstack(embeddings), dtype=np.float32)
+    if uses_cosine(index_type):
+        faiss.normalize_L2(matrix)
+    return matrix
+
+
+def ivf_nlist(n: int, index_type: str = INDEX_TYPE) -> int:
+    """Число кластеров IVF для n обучающих векторов; 0 — векторов для обучения недостаточно."""
+    nlist = min(RAG_CONFIG['ivf_nlist'], n // IVF_POINTS_PER_CENTROID)
+    if nlist < 1 or (index_type == 'ivf_pq' and n < PQ_MIN_TRAIN):
+        return 0
+    return nlist
+
+
+def build_index(dim: int, train: np.ndarray, index_type: str = INDEX_TYPE):
+    """
+    Создаёт FAISS-индекс выбранного типа. IVF-индексы обучаются на train;
+    если векторов для обучения мало, используется точный IndexFlatIP.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown RAG index type: {index_type}. Expected one of {', '.join(INDEX_TYPES)}")
+    if index_type == 'flat_l2':
+        return faiss.IndexFlatL2(dim)
+    if index_type == 'flat_ip':
+        return faiss.IndexFlatIP(dim)
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, RAG_CONFIG['hnsw_m'], faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = RAG_CONFIG['hnsw_ef_construction']
+        index.hnsw.efSearch = RAG_CONFIG['hnsw_ef_search']
+        return index
+
+    nlist = ivf_nlist(len(train), index_type)
+    if not nlist:
+        logging.warning(f'Недостаточно векторов ({len(train)}) для обучения {index_type}, '
+                        f'пока используется flat_ip')
+        return faiss.IndexFlatIP(dim)
+    quantizer = faiss.IndexFlatIP(dim)
+    if index_type == 'ivf_flat':
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, RAG_CONFIG['ivf_pq_m'], 8, faiss.METRIC_INNER_PRODUCT)
+    index.train(train)
+    index.nprobe = min(RAG_CONFIG['ivf_nprobe'], nlist)
+    return index
+
+
+def search_params(index, selector):
+    """Параметры поиска с фильтром по id: тип параметров должен соответствовать вложенному индексу."""
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=inner.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+def id_selector(ids: np.ndarray):
+    return faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+
 
 class MessageVectorStore:
-    def __init__(self):
+    """
+    FAISS-индекс сообщений с id сообщений Telegram в качестве id векторов (IndexIDMap2).
+
+    Если задан chat_id, индекс и отображение id → сообщение сохраняются на диск
+    (RAG_INDEX_DIR) и обновляются инкрементально: новые сообщения добавляются,
+    выпавшие из окна хранения — удаляются по id. IVF-индекс переобучается на всех
+    векторах, когда их становится достаточно для вдвое большего числа кластеров
+    (в том числе когда из-за малого первого пакета он был построен как flat_ip).
+    """
+
+    def __init__(self, chat_id=None, index_type: str = INDEX_TYPE):
+        self.chat_id = chat_id
         self.index = None
-        self.messages: List[Dict] = []
-        self.embeddings: List[np.ndarray] = []
+        self.index_type = index_type
+        self.messages: Dict[int, Dict] = {}
         self.dim = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(RAG_CONFIG['index_dir'], f'{self.chat_id}.faiss')
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(RAG_CONFIG['index_dir'], f'{self.chat_id}.json')
+
+    def load(self) -> bool:
+        """Загружает индекс чата с диска."""
+        if self.chat_id is None or not os.path.exists(self.index_path) or not os.path.exists(self.meta_path):
+            return False
+        with open(self.meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('model') != RAG_MODEL or meta.get('index_type') != self.index_type:
+            logging.info(f'Индекс чата {self.chat_id} построен для другой модели или типа индекса, пересоздаём')
+            return False
+        self.index = faiss.read_index(self.index_path)
+        self.dim = meta['dim']
+        self.messages = {msg['id']: msg for msg in meta['messages']}
+        logging.info(f'Загружен индекс чата {self.chat_id}: {self.index.ntotal} векторов')
+        return True
+
+    def save(self):
+        """Атомарно сохраняет индекс и отображение id → сообщение."""
+        if self.chat_id is None or self.index is None:
+            return
+        os.makedirs(RAG_CONFIG['index_dir'], exist_ok=True)
+        faiss.write_index(self.index, self.index_path + '.tmp')
+        meta = {
+            'model': RAG_MODEL,
+            'index_type': self.index_type,
+            'dim': self.dim,
+            'messages': list(self.messages.values()),
+        }
+        with open(self.meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(self.index_path + '.tmp', self.index_path)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
 
     async def add_messages(self, messages: List[Dict]):
-        # Формируем расширенный контекст для каждого сообщения
-        texts = [self._message_context(msg) for msg in messages]
-        embeddings = await self.get_embeddings(texts)
-        if not embeddings:
+        # Уже проиндексированные сообщения повторно не добавляем
+        messages = [msg for msg in messages if msg['id'] not in self.messages]
+        if not messages:
             return
-        if self.index is None:
-            self.dim = len(embeddings[0])
-            self.index = faiss.IndexFlatL2(self.dim)
-        for emb, msg in zip(embeddings, messages):
-            self.index.add(np.array([emb], dtype=np.float32))
-            self.messages.append(msg)
-            self.embeddings.append(emb)
+        with stage('add_messages', items=len(messages)) as handle:
+            # Формируем расширенный контекст для каждого сообщения
+            texts = [self._message_context(msg) for msg in messages]
+            embeddings = await self.get_cached_embeddings(texts)
+            if not embeddings:
+                return
+            matrix = to_matrix(embeddings, self.index_type)
+            handle.bytes = matrix.nbytes
+            if self.index is None:
+                self.dim = matrix.shape[1]
+                self.index = faiss.IndexIDMap2(build_index(self.dim, matrix, self.index_type))
+            # Одним вызовом добавляем всю матрицу
+            ids = np.array([msg['id'] for msg in messages], dtype=np.int64)
+            self.index.add_with_ids(matrix, ids)
+            self.messages.update(zip(ids.tolist(), messages))
+        if self.needs_retrain():
+            await self.retrain()
+
+    def trained_nlist(self) -> int:
+        """Число кластеров текущего IVF-индекса; 0 — индекс не IVF (в том числе запасной flat_ip)."""
+        inner = faiss.downcast_index(self.index.index)
+        return inner.nlist if isinstance(inner, faiss.IndexIVF) else 0
+
+    def needs_retrain(self) -> bool:
+        if self.index is None or self.index_type not in IVF_TYPES:
+            return False
+        target = ivf_nlist(self.index.ntotal, self.index_type)
+        return target > 0 and target >= 2 * self.trained_nlist()
+
+    async def retrain(self):
+        """
+        Пересобирает IVF-индекс, обучая его на всех сообщениях. Векторы берутся из кэша
+        эмбеддингов: IVF-PQ хранит только сжатые коды, восстанавливать из них нельзя.
+        """
+        ids = list(self.messages)
+        with stage('retrain_index', items=len(ids)):
+            embeddings = await self.get_cached_embeddings([self._message_context(self.messages[i]) for i in ids])
+            matrix = to_matrix(embeddings, self.index_type)
+            index = faiss.IndexIDMap2(build_index(self.dim, matrix, self.index_type))
+            index.add_with_ids(matrix, np.array(ids, dtype=np.int64))
+        previous = self.trained_nlist()
+        self.index = index
+        logging.info(f'Индекс чата {self.chat_id} переобучен на {len(ids)} векторах: '
+                     f'{previous} → {self.trained_nlist()} кластеров')
+
+    def remove_ids(self, ids: Sequence[int]) -> int:
+        """Удаляет сообщения из индекса по id. Возвращает число удалённых векторов."""
+        ids = np.array([i for i in ids if i in self.messages], dtype=np.int64)
+        if self.index is None or not len(ids):
+            return 0
+        try:
+            removed = self.index.remove_ids(id_selector(ids))
+        except RuntimeError:
+            # HNSW не поддерживает удаление — пересобираем индекс из оставшихся векторов
+            removed = self._rebuild_without(ids)
+        for i in ids.tolist():
+            self.messages.pop(i, None)
+        return removed
+
+    def _rebuild_without(self, ids: np.ndarray) -> int:
+        all_ids = faiss.vector_to_array(self.index.id_map)
+        vectors = self.index.index.reconstruct_n(0, self.index.ntotal)
+        keep = ~np.isin(all_ids, ids)
+        index = faiss.IndexIDMap2(build_index(self.dim, vectors[keep], self.index_type))
+        if keep.any():
+            index.add_with_ids(np.ascontiguousarray(vectors[keep]), all_ids[keep])
+        self.index = index
+        return int((~keep).sum())
+
+    def prune(self, before: datetime) -> int:
+        """Удаляет из индекса сообщения старше before (окно хранения)."""
+        expired = [
+            msg_id for msg_id, msg in self.messages.items()
+            if datetime.fromisoformat(msg['date']).timestamp() < before.timestamp()
+        ]
+        return self.remove_ids(expired)
 
     def _message_context(self, msg: Dict) -> str:
         """
@@ -75,21 +274,59 @@ class MessageVectorStore:
 
         return " ".join(parts)
 
+    async def get_cached_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        Возвращает эмбеддинги с учётом персистентного кэша: в API уходят только промахи.
+        """
+        if not texts:
+            return []
+        cache = get_embedding_cache()
+        hashes = [text_hash(text) for text in texts]
+        found = cache.get_many(RAG_MODEL, hashes)
+
+        # Один и тот же текст может встречаться несколько раз — эмбеддим его единожды
+        missing = {key: text for key, text in zip(hashes, texts) if key not in found}
+        if missing:
+            fresh = await self.get_embeddings(list(missing.values()))
+            computed = dict(zip(missing.keys(), fresh))
+            cache.put_many(RAG_MODEL, computed)
+            found.update(computed)
+        incr('embedding_cache_hits', len(texts) - len(missing))
+        incr('embedding_cache_misses', len(missing))
+        logging.info(f'Эмбеддинги: из кэша {len(texts) - len(missing)}, запрошено у API {len(missing)}')
+        return [found[key] for key in hashes]
+
     async def get_embeddings(self, texts: List[str]) -> List[np.ndarray]:
-        # Используем RAG API для получения эмбеддингов
-        response = await RAG_CLIENT.embeddings.create(
-            model=RAG_MODEL,
-            input=texts
-        )
-        return [np.array(data.embedding, dtype=np.float32) for data in response.data]
+        # Используем RAG API для получения эмбеддингов (батчами, параллельно)
+        return await embed_texts(texts)
 
-    def search(self, query_emb: np.ndarray, top_k: int = 20) -> List[Dict]:
-        D, I = self.index.search(np.array([query_emb], dtype=np.float32), top_k)
-        return [self.messages[i] for i in I[0] if i < len(self.messages)]
+    def search(self, query_emb: np.ndarray, top_k: int = 20, ids: Optional[Sequence[int]] = None) -> List[Dict]:
+        """Ищет ближайшие сообщения; ids ограничивает поиск подмножеством (например, окном отчёта)."""
+        if self.index is None:
+            return []
+        params = None
+        if ids is not None:
+            params = search_params(self.index, id_selector(np.array(list(ids), dtype=np.int64)))
+        D, I = self.index.search(to_matrix([query_emb], self.index_type), top_k, params=params)
+        # FAISS возвращает -1, если найдено меньше top_k соседей
+        return [self.messages[i] for i in I[0].tolist() if i in self.messages]
 
     async def get_query_embedding(self, query: str) -> np.ndarray:
-        response = await RAG_CLIENT.embeddings.create(
-            model=RAG_MODEL,
-            input=[query]
-        )
-        return np.array(response.data[0].embedding, dtype=np.float32)
+        return (await self.get_cached_embeddings([query]))[0]
+
+
+_stores: Dict[str, MessageVectorStore] = {}
+
+
+def get_vector_store(chat_id) -> MessageVectorStore:
+    """
+    Возвращает общий для процесса индекс чата, при первом обращении загружая его с диска.
+    Все отчёты и запросы по чату в рамках процесса работают с одним экземпляром.
+    """
+    key = str(chat_id)
+    if key not in _stores:
+        store = MessageVectorStore(chat_id)
+        store.load()
+        _stores[key] = store
+    return _stores[key]
+
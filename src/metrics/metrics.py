@@ -0,0 +1,217 @@
+"""
+Метрики пайплайна: длительность и объём работы по этапам, счётчики (токены, попадания
+в кэши, повторы) для каждого запуска.
+
+Текущий запуск хранится в contextvar, поэтому этапы в любых модулях пишут метрики
+без явной передачи объекта. По завершении запуска JSON-запись дописывается в
+METRICS_DIR/runs.jsonl, а накопительные метрики процесса — в METRICS_DIR/metrics.prom
+(текстовый формат Prometheus, например для node_exporter textfile collector).
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from src.config.config import load_config
+
+config = load_config()
+METRICS_DIR = config['METRICS_DIR']
+
+_current_run: ContextVar[Optional['RunMetrics']] = ContextVar('current_run', default=None)
+
+# Накопительные метрики процесса: (метрика, метки) → значение
+_totals: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+
+class StageRecord:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.items = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'duration_seconds': round(self.duration, 4),
+            'items': self.items,
+            'bytes': self.bytes,
+            'errors': self.errors,
+        }
+
+
+class RunMetrics:
+    def __init__(self, job: str):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.job = job
+        self.started_at = datetime.now()
+        self._started = time.perf_counter()
+        self.stages: Dict[str, StageRecord] = {}
+        self.counters: Dict[str, float] = {}
+
+    def stage_record(self, name: str) -> StageRecord:
+        if name not in self.stages:
+            self.stages[name] = StageRecord()
+        return self.stages[name]
+
+    def to_dict(self, status: str) -> Dict:
+        return {
+            'run_id': self.run_id,
+            'job': self.job,
+            'started_at': self.started_at.isoformat(),
+            'duration_seconds': round(time.perf_counter() - self._started, 4),
+            'status': status,
+            'stages': {name: record.to_dict() for name, record in self.stages.items()},
+            'counters': self.counters,
+        }
+
+
+class StageHandle:
+    """Позволяет этапу сообщить объём обработанных данных."""
+
+    def __init__(self):
+        self.items = 0
+        self.bytes = 0
+
+
+@contextmanager
+def stage(name: str, items: int = 0):
+    """Замеряет этап текущего запуска; без активного запуска ничего не пишет."""
+    handle = StageHandle()
+    handle.items = items
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield handle
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        run = _current_run.get()
+        if run is not None:
+            record = run.stage_record(name)
+            record.count += 1
+            record.duration += time.perf_counter() - started
+            record.items += handle.items
+            record.bytes += handle.bytes
+            record.errors += int(failed)
+
+
+def incr(name: str, value: float = 1):
+    """Увеличивает счётчик текущего запуска (токены, попадания в кэш, повторы...)."""
+    run = _current_run.get()
+    if run is not None and value:
+        run.counters[name] = run.counters.get(name, 0) + value
+
+
+def start_run(job: str) -> RunMetrics:
+    run = RunMetrics(job)
+    _current_run.set(run)
+    return run
+
+
+def finish_run(run: RunMetrics, status: str):
+    """Сохраняет JSON-запись запуска и обновляет файл метрик Prometheus."""
+    record = run.to_dict(status)
+    stages = ', '.join(f"{name} {data['duration_seconds']:.2f}s" for name, data in record['stages'].items())
+    logging.info(f'[{run.job}] Метрики запуска {run.run_id}: {record["duration_seconds"]:.2f}s ({stages})')
+    _update_totals(run, record)
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(os.path.join(METRICS_DIR, 'runs.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        _write_prometheus(os.path.join(METRICS_DIR, 'metrics.prom'))
+    except OSError as e:
+        logging.warning(f'Не удалось сохранить метрики: {e}')
+
+
+@contextmanager
+def track_run(job: str):
+    """Оборачивает запуск пайплайна: создаёт RunMetrics и сохраняет его со статусом."""
+    run = start_run(job)
+    status = 'success'
+    try:
+        yield run
+    except BaseException:
+        status = 'failed'
+        raise
+    finally:
+        finish_run(run, status)
+        _current_run.set(None)
+
+
+def _add_total(metric: str, value: float, **labels):
+    key = (metric, tuple(sorted(labels.items())))
+    _totals[key] = _totals.get(key, 0) + value
+
+
+def _set_total(metric: str, value: float, **labels):
+    _totals[(metric, tuple(sorted(labels.items())))] = value
+
+
+def _update_totals(run: RunMetrics, record: Dict):
+    job = run.job
+    _add_total('digest_runs_total', 1, job=job, status=record['status'])
+    _set_total('digest_run_last_duration_seconds', record['duration_seconds'], job=job)
+    _set_total('digest_run_last_success', int(record['status'] == 'success'), job=job)
+    _set_total('digest_run_last_timestamp_seconds', time.time(), job=job)
+    for name, data in record['stages'].items():
+        _add_total('digest_stage_duration_seconds_sum', data['duration_seconds'], job=job, stage=name)
+        _add_total('digest_stage_duration_seconds_count', data['count'], job=job, stage=name)
+        _add_total('digest_stage_items_total', data['items'], job=job, stage=name)
+        _add_total('digest_stage_bytes_total', data['bytes'], job=job, stage=name)
+        _add_total('digest_stage_errors_total', data['errors'], job=job, stage=name)
+    for name, value in record['counters'].items():
+        _add_total('digest_counter_total', value, job=job, name=name)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+# Тип каждого семейства метрик для строк # TYPE; _sum и _count относятся к семейству summary
+METRIC_TYPES = {
+    'digest_runs_total': 'counter',
+    'digest_run_last_duration_seconds': 'gauge',
+    'digest_run_last_success': 'gauge',
+    'digest_run_last_timestamp_seconds': 'gauge',
+    'digest_stage_duration_seconds': 'summary',
+    'digest_stage_items_total': 'counter',
+    'digest_stage_bytes_total': 'counter',
+    'digest_stage_errors_total': 'counter',
+    'digest_counter_total': 'counter',
+}
+
+
+def _family(metric: str) -> str:
+    for suffix in ('_sum', '_count'):
+        if metric.endswith(suffix) and metric[:-len(suffix)] in METRIC_TYPES:
+            return metric[:-len(suffix)]
+    return metric
+
+
+def render_prometheus() -> str:
+    lines = []
+    family = None
+    for (metric, labels), value in sorted(_totals.items()):
+        if _family(metric) != family:
+            family = _family(metric)
+            lines.append(f'# TYPE {family} {METRIC_TYPES.get(family, "untyped")}')
+        # repr сохраняет все значащие цифры: :g округлил бы метку времени и большие суммы байт
+        lines.append(f'{metric}{_format_labels(labels)} {float(value)!r}')
+    return '\n'.join(lines) + '\n'
+
+
+def _write_prometheus(path: str):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
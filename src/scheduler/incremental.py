@@ -0,0 +1,109 @@
+"""
+Инкрементальный режим дайджеста: дневные частичные отчёты и дешёвое недельное сведение.
+
+Ежедневная задача догружает сообщения и суммаризирует каждый завершившийся день окна,
+для которого ещё нет частичного отчёта. Недельная задача досчитывает пропущенные дни
+(например, упавшие), отдельно — неполные крайние дни окна (от начала окна до полуночи
+и от полуночи до планового запуска), и сводит частичные отчёты одним небольшим
+reduce-запросом. Окно то же, что в режиме full, поэтому соседние отчёты стыкуются без дыр.
+"""
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from src.config.config import load_config
+from src.llm.client import NoMessagesError, merge_reports, summarize
+from src.metrics.metrics import incr, stage
+from src.storage.archive import get_archive
+from src.storage.partials import get_partial_store
+
+config = load_config()
+TIMEZONE = ZoneInfo(config['SCHEDULER_TIMEZONE'])
+RETENTION_DAYS = config['RAG_CONFIG']['retention_days']
+
+
+def today() -> date:
+    return datetime.now(TIMEZONE).date()
+
+
+def day_bounds(day: date) -> Tuple[datetime, datetime]:
+    """Границы дня [начало, начало следующего) в часовом поясе расписания."""
+    since = datetime.combine(day, time(), tzinfo=TIMEZONE)
+    return since, since + timedelta(days=1)
+
+
+def window_days(day_offset: int, until: Optional[date] = None) -> List[date]:
+    """Завершившиеся дни окна отчёта: day_offset дней до until (по умолчанию — до сегодня)."""
+    until = until or today()
+    return [until - timedelta(days=offset) for offset in range(day_offset, 0, -1)]
+
+
+async def summarize_day(job: Dict, chat_key, day: date, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None) -> Tuple[Optional[Dict], int]:
+    """
+    Частичный отчёт по сообщениям одного дня (с since и до until, если окно захватывает
+    день не целиком); (None, число сообщений), если сообщений не было или остались
+    только шум и дубликаты.
+    """
+    day_start, day_end = day_bounds(day)
+    since = max(since, day_start) if since else day_start
+    until = min(until, day_end) if until else day_end
+    messages = get_archive().get_messages(chat_key, since, until)
+    if not messages:
+        return None, 0
+    logging.info(f'[{job["name"]}] Частичный отчёт за {day}: {len(messages)} сообщений')
+    try:
+        report = await summarize(messages, chat_id=chat_key, queries=job['rag_queries'], top_k=job['top_k'])
+    except NoMessagesError:
+        # День без содержательных сообщений сохраняется пустым, а не падает при каждом сведении
+        logging.info(f'[{job["name"]}] За {day} нет содержательных сообщений')
+        return None, len(messages)
+    return report, len(messages)
+
+
+async def fill_partials(job: Dict, chat_key, days: List[date]) -> Dict[date, Optional[Dict]]:
+    """Возвращает частичные отчёты за days, досчитывая и сохраняя отсутствующие."""
+    store = get_partial_store()
+    partials = store.get_many(chat_key, days)
+    missing = [day for day in days if day not in partials]
+    incr('partials_reused', len(days) - len(missing))
+    for day in missing:
+        with stage('daily_partial', items=1):
+            report, count = await summarize_day(job, chat_key, day)
+        store.put(chat_key, day, report, count)
+        partials[day] = report
+    incr('partials_computed', len(missing))
+    if missing:
+        logging.info(f'[{job["name"]}] Посчитаны частичные отчёты: {", ".join(map(str, missing))}')
+    return partials
+
+
+async def run_daily(job: Dict, chat_key) -> int:
+    """Досчитывает частичные отчёты за завершившиеся дни окна. Возвращает число дней с отчётами."""
+    partials = await fill_partials(job, chat_key, window_days(max(job['day_offset'] - 1, 1)))
+    get_partial_store().prune(chat_key, today() - timedelta(days=max(RETENTION_DAYS, job['day_offset'])))
+    return sum(report is not None for report in partials.values())
+
+
+async def build_weekly_report(job: Dict, chat_key, since: datetime, until: datetime) -> Dict:
+    """
+    Итоговый отчёт за окно [since, until) из дневных частичных отчётов. Крайние дни окна
+    захвачены не целиком, поэтому их отчёты считаются заново по своей части дня
+    и не сохраняются.
+    """
+    since, until = since.astimezone(TIMEZONE), until.astimezone(TIMEZONE)
+    first = since.date() if since == day_bounds(since.date())[0] else since.date() + timedelta(days=1)
+    days = [first + timedelta(days=offset) for offset in range((until.date() - first).days)]
+    partials = await fill_partials(job, chat_key, days)
+    reports = [partials[day] for day in days if partials[day] is not None]
+    if first != since.date():
+        head, _ = await summarize_day(job, chat_key, since.date(), since=since, until=until)
+        if head is not None:
+            reports.insert(0, head)
+    if until.date() >= first and until != day_bounds(until.date())[0]:
+        current, _ = await summarize_day(job, chat_key, until.date(), since=since, until=until)
+        if current is not None:
+            reports.append(current)
+    logging.info(f'[{job["name"]}] Недельное сведение: {len(reports)} дневных отчётов')
+    return await merge_reports(reports)
@@ -0,0 +1,143 @@
+"""
+Потоковая загрузка сообщений чата: fetch → filter → normalize → archive → embed → index.
+
+Этапы соединены ограниченными очередями, поэтому эмбеддинг первых пачек начинается,
+пока история ещё скачивается, а пиковая память не зависит от размера чата.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, List
+
+from src.config.config import load_config
+from src.llm.conversations import must_include
+from src.llm.dedup import Deduplicator
+from src.metrics.metrics import incr, stage
+from src.storage.archive import get_archive
+from src.telegram.records import MessageRecord
+from src.telegram.sender_cache import get_sender_cache
+from src.telegram.telethon_client import (is_relevant, iter_new_messages, iter_old_messages, normalize_message,
+                                          open_chat)
+
+config = load_config()
+BATCH_SIZE = config['INGEST_BATCH_SIZE']
+QUEUE_SIZE = config['INGEST_QUEUE_SIZE']
+RETENTION_DAYS = config['ARCHIVE_RETENTION_DAYS']
+RAG_CONFIG = config['RAG_CONFIG']
+
+# Маркер конца потока в очередях
+_DONE = object()
+
+
+async def run_stages(*stages: Awaitable):
+    """Выполняет этапы конвейера; при ошибке одного этапа отменяет остальные."""
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def ingest(chat_id_or_username: str, day_offset: int, index: bool = True) -> int:
+    """
+    Догружает новые сообщения чата в архив и (если index) в персистентный индекс чата.
+    Если окно начинается раньше загруженной истории, догружает и более старые сообщения.
+    Возвращает peer id чата (ключ в архиве и индексе).
+    """
+    since = datetime.now() - timedelta(days=day_offset)
+    archive = get_archive()
+    client, entity, chat_key = await open_chat(chat_id_or_username)
+    min_id = archive.get_last_message_id(chat_key)
+    covered = archive.get_coverage_start(chat_key)
+    store = None
+    if index:
+        # faiss загружается только если загрузка сразу индексирует сообщения
+        from src.llm.vector_store import get_vector_store
+        store = get_vector_store(chat_key)
+    # Почти-дубликаты и шум архивируются, но не эмбеддятся
+    dedup = Deduplicator() if store is not None and RAG_CONFIG['dedup'] else None
+    senders = get_sender_cache(chat_key)
+    await senders.warm(client, entity)
+
+    raw_queue: asyncio.Queue = asyncio.Queue(maxsize=BATCH_SIZE * 2)
+    batch_queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    stats = {'fetched': 0, 'backfilled': 0, 'stored': 0, 'last_seen_id': min_id, 'truncated': False}
+
+    async def fetch():
+        async for msg in iter_new_messages(client, entity, min_id, since, stats):
+            stats['fetched'] += 1
+            stats['last_seen_id'] = max(stats['last_seen_id'], msg.id)
+            await raw_queue.put(msg)
+        if min_id and covered is not None and since < covered:
+            # Запрошено окно длиннее загруженной истории: догружаем недостающее начало
+            async for msg in iter_old_messages(client, entity, covered, since):
+                stats['fetched'] += 1
+                stats['backfilled'] += 1
+                await raw_queue.put(msg)
+        await raw_queue.put(_DONE)
+
+    async def normalize():
+        batch: List[MessageRecord] = []
+        while True:
+            msg = await raw_queue.get()
+            if msg is _DONE:
+                break
+            if is_relevant(msg):
+                batch.append(normalize_message(msg, senders))
+            if len(batch) >= BATCH_SIZE:
+                await flush(batch)
+                batch = []
+        await flush(batch)
+        await batch_queue.put(_DONE)
+
+    async def flush(batch: List[MessageRecord]):
+        if not batch:
+            return
+        archive.save_messages(chat_key, batch)
+        stats['stored'] += len(batch)
+        if store is not None:
+            await batch_queue.put(batch)
+
+    async def embed_and_index():
+        while True:
+            batch = await batch_queue.get()
+            if batch is _DONE:
+                break
+            messages = [record.to_dict() for record in batch]
+            if dedup is not None:
+                required = {msg['id'] for msg in must_include(messages)}
+                messages = [msg for msg in messages if msg['id'] in required or dedup.accept(msg)]
+            async with store.lock:
+                await store.add_messages(messages)
+
+    stages = [fetch(), normalize()]
+    if store is not None:
+        stages.append(embed_and_index())
+    with stage('ingest') as handle:
+        await run_stages(*stages)
+
+        # Отметку сдвигаем только после полной загрузки: сообщения идут от новых к старым
+        archive.set_last_message_id(chat_key, stats['last_seen_id'])
+        # Загрузка не дошла до прежней отметки (процесс долго стоял): история до since неполная
+        archive.extend_coverage(chat_key, since, reset=bool(min_id) and stats['truncated'])
+        # Архив не растёт бесконечно: храним не меньше окна текущей загрузки
+        pruned = archive.prune(chat_key, datetime.now() - timedelta(days=max(RETENTION_DAYS, day_offset)))
+        if store is not None:
+            async with store.lock:
+                store.save()
+        handle.items = stats['stored']
+    incr('messages_fetched', stats['fetched'])
+    incr('messages_backfilled', stats['backfilled'])
+    incr('messages_stored', stats['stored'])
+    incr('messages_pruned', pruned)
+    if dedup is not None:
+        dedup.report()
+    logging.info(f'Загрузка чата {chat_id_or_username}: получено {stats["fetched"]} '
+                 f'(из них старых {stats["backfilled"]}), '
+                 f'сохранено {stats["stored"]} новых сообщений'
+                 + (f', не проиндексировано дубликатов {dedup.duplicates} и шума {dedup.noise}'
+                    if dedup is not None else ''))
+    return chat_key
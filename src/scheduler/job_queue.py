@@ -0,0 +1,147 @@
+"""
+Общая очередь запусков пайплайна: плановые задачи планировщика и запросы /digest из бота.
+
+Запуски выполняет пул из JOBS_CONCURRENCY воркеров, ожидающих запросов из бота — не больше
+DIGEST_QUEUE_SIZE. Запрос с тем же ключом, что у ожидающего или выполняющегося запуска,
+не ставится повторно, а присоединяется к нему: получатели объединяются, результат общий.
+Запуск сообщает о ходе выполнения подписчикам и может быть отменён.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.config.config import load_config
+
+config = load_config()
+WORKERS = config['JOBS_CONCURRENCY']
+QUEUE_SIZE = config['DIGEST_QUEUE_SIZE']
+
+Progress = Callable[[str], Awaitable[None]]
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass(eq=False)
+class QueuedRun:
+    key: str
+    factory: Callable[['QueuedRun'], Awaitable[Dict]]
+    future: asyncio.Future
+    destinations: List[str] = field(default_factory=list)
+    listeners: List[Progress] = field(default_factory=list)
+    state: str = QUEUED
+    task: Optional[asyncio.Task] = None
+
+    async def report(self, text: str):
+        """Сообщает подписчикам о ходе выполнения; ошибка подписчика не влияет на запуск."""
+        for listener in list(self.listeners):
+            try:
+                await listener(text)
+            except Exception as e:
+                logging.warning(f'Не удалось обновить статус запуска {self.key}: {e}')
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+        elif not self.future.done():
+            self.future.cancel()
+
+    async def wait(self) -> Dict:
+        # shield: отмена одного ожидающего не отменяет общий запуск
+        return await asyncio.shield(self.future)
+
+
+class RunQueue:
+    def __init__(self, workers: int = WORKERS, maxsize: int = QUEUE_SIZE):
+        self.workers = workers
+        self.maxsize = maxsize
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._runs: Dict[str, QueuedRun] = {}
+        self._pending: List[QueuedRun] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def _ensure_workers(self):
+        # Воркеры создаются при первой постановке, когда event loop уже запущен
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, key: str, factory: Callable[[QueuedRun], Awaitable[Dict]],
+               destinations: Iterable[str] = (), listener: Optional[Progress] = None,
+               bounded: bool = True) -> Tuple[QueuedRun, bool]:
+        """
+        Ставит запуск в очередь; возвращает (запуск, присоединён ли к уже существующему).
+        Если ожидающих уже maxsize, поднимает QueueFull. Плановые запуски (bounded=False)
+        ставятся всегда: их не больше, чем задач в конфигурации.
+        """
+        run = self._runs.get(key)
+        coalesced = run is not None
+        if run is None:
+            if bounded and len(self._pending) >= self.maxsize:
+                raise QueueFull(f'ожидают {len(self._pending)} запусков')
+            run = QueuedRun(key, factory, asyncio.get_running_loop().create_future())
+            self._runs[key] = run
+            self._pending.append(run)
+            self._ensure_workers()
+            self._queue.put_nowait(run)
+        for destination in destinations:
+            if destination not in run.destinations:
+                run.destinations.append(destination)
+        if listener is not None:
+            run.listeners.append(listener)
+        return run, coalesced
+
+    def position(self, run: QueuedRun) -> Optional[int]:
+        """Сколько запусков ждут в очереди впереди; None — запуск уже выполняется или завершён."""
+        return self._pending.index(run) if run in self._pending else None
+
+    def cancel(self, predicate: Callable[[str], bool]) -> int:
+        """Отменяет ожидающие и выполняющиеся запуски, чей ключ подходит под predicate."""
+        runs = [run for key, run in self._runs.items() if predicate(key)]
+        for run in runs:
+            run.cancel()
+            if run.state == QUEUED:
+                # Отменённый запуск остаётся в asyncio.Queue до воркера, но к нему больше не присоединяются
+                del self._runs[run.key]
+                self._pending.remove(run)
+        return len(runs)
+
+    async def _worker(self):
+        while True:
+            run = await self._queue.get()
+            try:
+                if run in self._pending:
+                    self._pending.remove(run)
+                if run.future.done():
+                    # Отменён, пока ждал в очереди
+                    continue
+                run.state = RUNNING
+                run.task = asyncio.ensure_future(run.factory(run))
+                await asyncio.wait([run.task])
+                if run.task.cancelled():
+                    run.future.cancel()
+                elif run.task.exception() is not None:
+                    run.future.set_exception(run.task.exception())
+                else:
+                    run.future.set_result(run.task.result())
+            finally:
+                run.state = DONE
+                if self._runs.get(run.key) is run:
+                    del self._runs[run.key]
+                self._queue.task_done()
+
+
+_queue: Optional[RunQueue] = None
+
+
+def get_run_queue() -> RunQueue:
+    """Возвращает общую для процесса очередь запусков (её делят бот и планировщик)."""
+    global _queue
+    if _queue is None:
+        _queue = RunQueue()
+    return _queue
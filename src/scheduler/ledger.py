@@ -0,0 +1,147 @@
+"""
+Журнал запусков (SQLite): окно, статус и результат каждого запуска задачи.
+
+Ключ идемпотентности — (задача, чат, окно отчёта). Перезапуск процесса не повторяет
+уже отправленный отчёт, а после сбоя продолжает с упавшего этапа: готовый отчёт
+хранится в журнале, поэтому неудачная отправка повторяется без загрузки и LLM,
+а получатели, которым отчёт уже доставлен, его повторно не получают.
+"""
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from src.config.config import load_config
+from src.storage.sqlite import connect
+
+config = load_config()
+LEDGER_PATH = config['LEDGER_PATH']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    key          TEXT    PRIMARY KEY,
+    job          TEXT    NOT NULL,
+    chat_id      TEXT    NOT NULL,
+    window_start TEXT    NOT NULL,
+    window_end   TEXT    NOT NULL,
+    status       TEXT    NOT NULL,
+    stage        TEXT,
+    report       TEXT,
+    delivered    TEXT    NOT NULL DEFAULT '[]',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    error        TEXT,
+    created      REAL    NOT NULL,
+    updated      REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_chat_window ON runs (chat_id, window_end);
+"""
+
+RUNNING = 'running'
+SUMMARIZED = 'summarized'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+def run_key(job_name: str, chat_id, window_start: datetime, window_end: datetime) -> str:
+    return f'{job_name}|{chat_id}|{window_start.isoformat()}|{window_end.isoformat()}'
+
+
+@dataclass
+class Run:
+    key: str
+    job: str
+    chat_id: str
+    window_start: datetime
+    window_end: datetime
+    status: str
+    stage: Optional[str] = None
+    report: Optional[Dict] = None
+    delivered: List[str] = field(default_factory=list)
+    attempts: int = 0
+    error: Optional[str] = None
+    updated: float = 0.0
+
+
+class RunLedger:
+    def __init__(self, path: str = LEDGER_PATH):
+        self.path = path
+        self._conn = connect(path)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _row_to_run(self, row) -> Run:
+        key, job, chat_id, start, end, status, stage, report, delivered, attempts, error, updated = row
+        return Run(key, job, chat_id, datetime.fromisoformat(start), datetime.fromisoformat(end), status,
+                   stage, json.loads(report) if report else None, json.loads(delivered), attempts, error, updated)
+
+    def get(self, key: str) -> Optional[Run]:
+        row = self._conn.execute(
+            'SELECT key, job, chat_id, window_start, window_end, status, stage, report, delivered, '
+            'attempts, error, updated FROM runs WHERE key = ?', (key,)
+        ).fetchone()
+        return self._row_to_run(row) if row else None
+
+    def find_report(self, chat_id, span: timedelta, newer_than: datetime) -> Optional[Run]:
+        """Последний запуск по чату с готовым отчётом за окно длины span, закончившееся не раньше newer_than."""
+        rows = self._conn.execute(
+            'SELECT key, job, chat_id, window_start, window_end, status, stage, report, delivered, '
+            'attempts, error, updated FROM runs WHERE chat_id = ? AND report IS NOT NULL '
+            'ORDER BY updated DESC LIMIT 20', (str(chat_id),)
+        ).fetchall()
+        for row in rows:
+            run = self._row_to_run(row)
+            if run.window_end - run.window_start == span and run.window_end >= newer_than:
+                return run
+        return None
+
+    def start(self, key: str, job: str, chat_id, window_start: datetime, window_end: datetime) -> Run:
+        """Отмечает начало (или повтор) запуска; уже сохранённые отчёт и доставки не сбрасываются."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO runs (key, job, chat_id, window_start, window_end, status, attempts, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET status = excluded.status, attempts = attempts + 1, '
+                'error = NULL, updated = excluded.updated',
+                (key, job, str(chat_id), window_start.isoformat(), window_end.isoformat(), RUNNING, now, now)
+            )
+        return self.get(key)
+
+    def set_stage(self, key: str, stage: str):
+        self._update(key, stage=stage)
+
+    def save_report(self, key: str, report: Dict):
+        self._update(key, status=SUMMARIZED, report=json.dumps(report, ensure_ascii=False))
+
+    def add_delivered(self, key: str, chat_ids: List[str]):
+        run = self.get(key)
+        delivered = sorted(set(run.delivered) | {str(chat_id) for chat_id in chat_ids})
+        self._update(key, delivered=json.dumps(delivered))
+
+    def finish(self, key: str):
+        self._update(key, status=SENT, stage=None)
+
+    def fail(self, key: str, error: str):
+        self._update(key, status=FAILED, error=error)
+
+    def _update(self, key: str, **fields):
+        fields['updated'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f'UPDATE runs SET {assignments} WHERE key = ?', (*fields.values(), key))
+
+    def close(self):
+        self._conn.close()
+
+
+_ledger: Optional[RunLedger] = None
+
+
+def get_ledger() -> RunLedger:
+    """Возвращает общий для процесса журнал запусков."""
+    global _ledger
+    if _ledger is None:
+        _ledger = RunLedger()
+    return _ledger
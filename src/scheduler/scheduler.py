@@ -1,46 +1,269 @@
 """
-Модуль для запуска всего пайплайна раз в неделю через APScheduler.
+Модуль для запуска пайплайнов дайджеста по расписанию через APScheduler.
+
+Все задачи из JOBS (несколько исходных чатов, у каждого свои получатели,
+расписание, DAY_OFFSET и RAG-запросы) выполняются в одном процессе через общую
+с ботом очередь (/digest): одновременно работает не больше JOBS_CONCURRENCY пайплайнов.
+Задачи в режиме incremental дополнительно запускаются ежедневно и копят дневные
+частичные отчёты, а по основному расписанию только сводят их.
+
+Окно отчёта привязано к плановому времени запуска, а каждый запуск записывается
+в журнал (ledger): при старте процесса выполняется только пропущенный за время
+простоя запуск (SCHEDULER_CATCHUP), уже отправленные отчёты не повторяются,
+а упавший запуск продолжается с незавершённого этапа.
 """
 import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
 from zoneinfo import ZoneInfo
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 import logging
 
 from src.config.config import load_config
-from src.llm.client import summarize
-from src.telegram.sender import send_report
-from src.telegram.telethon_client import get_messages
+from src.metrics.metrics import track_run
+from src.scheduler.job_queue import Progress, QueuedRun, get_run_queue
+from src.scheduler.ledger import SENT, Run, get_ledger, run_key
+from src.storage.archive import get_archive
 
 config = load_config()
-CHAT_ID = config['TELEGRAM_CHAT_ID']
-TELEGRAM_DIST_CHAT_ID = config['TELEGRAM_DIST_CHAT_ID']
+JOBS = config['JOBS']
+# Эмбеддинги при загрузке нужны только для RAG-режима
+INDEX_ON_INGEST = config['LLM_CONFIG']['summary_mode'] == 'rag'
+TIMEZONE = ZoneInfo(config['SCHEDULER_TIMEZONE'])
+CATCHUP = config['SCHEDULER_CATCHUP']
+MISFIRE_GRACE = config['SCHEDULER_MISFIRE_GRACE']
 DAY_OFFSET = config['DAY_OFFSET']
+DIGEST_MODE = config['DIGEST_MODE']
+DIGEST_CACHE_TTL = config['DIGEST_CACHE_TTL']
+DIGEST_MAX_DAYS = config['DIGEST_MAX_DAYS']
+# Насколько далеко назад искать плановый запуск: от частых расписаний к редким
+SCHEDULE_LOOKBACKS = (timedelta(days=1), timedelta(days=8), timedelta(days=35))
 
 
-async def pipeline(chat_id: str = CHAT_ID):
-    """Запускает пайплайн для генерации и отправки отчёта."""
-    logging.info('Старт пайплайна...')
-    try:
-        messages = await get_messages(chat_id)
-        logging.info(f'Загружено сообщений: {len(messages)} из чата с ID: {chat_id}')
-        logging.info('Началась обработка сообщений через RAG...')
-        report = await summarize(messages)
-        await send_report(report, TELEGRAM_DIST_CHAT_ID)
-        logging.info('Отчёт успешно отправлен!')
-    except Exception as e:
-        logging.error(f'Ошибка в пайплайне: {str(e)}', exc_info=True)
-        raise
-
-
-async def schedule_weekly_job(chat_id: str = CHAT_ID):
-    """Запускает асинхронный планировщик для еженедельного отчёта и сразу выполняет задачу."""
-    scheduler = AsyncIOScheduler(timezone=ZoneInfo("Europe/Moscow"))
-    scheduler.add_job(pipeline, 'cron', day_of_week='sun', hour=18, minute=0, args=[chat_id])
-    logging.info('Планировщик запущен. Выполняем задачу немедленно...')
-    # 👇 Выполняем задачу сразу
-    await pipeline(chat_id)
+def job_trigger(job: Dict) -> CronTrigger:
+    return CronTrigger(timezone=TIMEZONE, **job['schedule'])
+
+
+def last_fire_time(trigger: CronTrigger, now: datetime) -> Optional[datetime]:
+    """Последнее плановое время срабатывания триггера не позже now."""
+    for lookback in SCHEDULE_LOOKBACKS:
+        fire_time = trigger.get_next_fire_time(None, now - lookback)
+        last = None
+        while fire_time is not None and fire_time <= now:
+            last = fire_time
+            fire_time = trigger.get_next_fire_time(fire_time, fire_time + timedelta(seconds=1))
+        if last is not None:
+            return last
+    return None
+
+
+def job_window(job: Dict, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """Окно отчёта: day_offset дней до последнего планового запуска (или до now, если его не было)."""
+    now = now or datetime.now(TIMEZONE)
+    window_end = last_fire_time(job_trigger(job), now) or now
+    return window_end - timedelta(days=job['day_offset']), window_end
+
+
+async def execute_run(run: QueuedRun, job: Dict, key: str, since: datetime, until: datetime) -> Dict:
+    """
+    Выполняет запуск с записью этапов в журнал: загрузка, суммаризация и отправка тем
+    получателям run.destinations, которым отчёт ещё не доставлен. Возвращает отчёт.
+    Если отчёт за окно уже есть в журнале, загрузка и LLM пропускаются.
+    """
+    # Тяжёлые зависимости (Telethon, LangChain, faiss) грузятся при первом запуске задачи
+    from src.llm.client import summarize
+    from src.scheduler.incremental import build_weekly_report
+    from src.scheduler.ingest import ingest
+    from src.telegram.sender import deliver_report
+
+    chat_id = job['chat_id']
+    ledger = get_ledger()
+    with track_run(job['name']):
+        logging.info(f'[{job["name"]}] Старт пайплайна (окно {since:%Y-%m-%d %H:%M} — {until:%Y-%m-%d %H:%M})...')
+        stored = ledger.start(key, job['name'], chat_id, since, until)
+        try:
+            report = stored.report
+            if report is None:
+                ledger.set_stage(key, 'ingest')
+                await run.report('📥 Загружаю сообщения...')
+                # Загружаем с запасом, если запуск догоняет пропущенное окно
+                days = max(job['day_offset'], (datetime.now(TIMEZONE) - since).days + 1)
+                chat_key = await ingest(chat_id, days, index=INDEX_ON_INGEST)
+                ledger.set_stage(key, 'summarize')
+                await run.report('🧠 Готовлю отчёт...')
+                if job['mode'] == 'incremental':
+                    report = await build_weekly_report(job, chat_key, since, until)
+                else:
+                    messages = get_archive().get_messages(chat_key, since, until)
+                    logging.info(f'[{job["name"]}] Загружено сообщений: {len(messages)} из чата с ID: {chat_id}')
+                    logging.info(f'[{job["name"]}] Началась обработка сообщений через RAG...')
+                    report = await summarize(messages, chat_id=chat_key, queries=job['rag_queries'],
+                                             top_k=job['top_k'])
+                ledger.save_report(key, report)
+            else:
+                logging.info(f'[{job["name"]}] Отчёт уже готов, повторяем только отправку')
+
+            ledger.set_stage(key, 'send')
+            await run.report('📤 Отправляю отчёт...')
+            pending = [chat for chat in run.destinations if chat not in stored.delivered]
+            errors = await deliver_report(report, pending)
+            ledger.add_delivered(key, [chat for chat, error in errors.items() if error is None])
+            failed = [chat for chat, error in errors.items() if error is not None]
+            if failed:
+                raise Exception(f"Отчёт не доставлен в чаты: {', '.join(failed)}")
+            ledger.finish(key)
+            logging.info(f'[{job["name"]}] Отчёт успешно отправлен!')
+            return report
+        except asyncio.CancelledError:
+            ledger.fail(key, 'Запуск отменён')
+            logging.info(f'[{job["name"]}] Запуск отменён')
+            raise
+        except Exception as e:
+            ledger.fail(key, str(e))
+            logging.error(f'[{job["name"]}] Ошибка в пайплайне: {str(e)}', exc_info=True)
+            raise
+
+
+async def pipeline(job: Dict):
+    """
+    Запускает пайплайн для генерации и отправки отчёта по одной задаче через общую очередь.
+    Идемпотентен по (задача, чат, окно): отправленный отчёт не повторяется, готовый —
+    только доотправляется тем получателям, которым ещё не доставлен.
+    """
+    since, until = job_window(job)
+    key = run_key(job['name'], job['chat_id'], since, until)
+    stored = get_ledger().get(key)
+    if stored is not None and stored.status == SENT:
+        logging.info(f'[{job["name"]}] Отчёт за окно до {until:%Y-%m-%d %H:%M} уже отправлен, пропускаем')
+        return
+    run, _ = get_run_queue().submit(key, lambda run: execute_run(run, job, key, since, until),
+                                    destinations=job['destinations'], bounded=False)
+    await run.wait()
+
+
+async def daily_run(run: QueuedRun, job: Dict):
+    from src.scheduler.incremental import run_daily
+    from src.scheduler.ingest import ingest
+
+    with track_run(f'{job["name"]}:daily'):
+        try:
+            chat_key = await ingest(job['chat_id'], job['day_offset'], index=INDEX_ON_INGEST)
+            days = await run_daily(job, chat_key)
+            logging.info(f'[{job["name"]}] Дневные отчёты готовы, дней с сообщениями: {days}')
+        except Exception as e:
+            logging.error(f'[{job["name"]}] Ошибка в дневном пайплайне: {str(e)}', exc_info=True)
+            raise
+
 
+async def daily_pipeline(job: Dict):
+    """
+    Инкрементальный режим: догружает сообщения и досчитывает дневные частичные отчёты.
+    Идемпотентен сам по себе: уже посчитанные дни не пересчитываются.
+    """
+    key = f'daily|{job["name"]}|{datetime.now(TIMEZONE).date()}'
+    run, _ = get_run_queue().submit(key, lambda run: daily_run(run, job), bounded=False)
+    await run.wait()
+
+
+def find_job(chat: str) -> Optional[Dict]:
+    """Задача дайджеста по имени или chat_id."""
+    return next((job for job in JOBS if chat in (job['name'], job['chat_id'])), None)
+
+
+def digest_key(chat_id: str, days: int) -> str:
+    return f'digest|{chat_id}|{days}'
+
+
+def request_digest(chat: str, days: Optional[int], destination: str,
+                   listener: Progress) -> Tuple[Optional[QueuedRun], Optional[Run], bool]:
+    """
+    Запрос отчёта по требованию (/digest) за последние days дней (по умолчанию — DAY_OFFSET задачи).
+    Не ждёт выполнения. Возвращает (запуск, None, присоединён ли к такому же запросу) или
+    (None, готовый запуск из журнала, False), если такое же окно посчитано не раньше DIGEST_CACHE_TTL назад.
+    Поднимает QueueFull, если очередь заполнена, и ValueError, если days больше DIGEST_MAX_DAYS.
+    """
+    base = find_job(chat) or {
+        'name': chat, 'chat_id': chat, 'day_offset': DAY_OFFSET,
+        'rag_queries': None, 'top_k': None, 'mode': DIGEST_MODE,
+    }
+    days = days or base['day_offset']
+    if days > DIGEST_MAX_DAYS:
+        raise ValueError(f'окно не больше {DIGEST_MAX_DAYS} дней')
+    job = {**base, 'name': f'digest:{base["name"]}', 'day_offset': days}
+    now = datetime.now(TIMEZONE)
+    cached = get_ledger().find_report(job['chat_id'], timedelta(days=days), now - timedelta(seconds=DIGEST_CACHE_TTL))
+    if cached is not None:
+        return None, cached, False
+
+    async def start(run: QueuedRun) -> Dict:
+        # Окно считается от момента запуска, а не постановки в очередь
+        until = datetime.now(TIMEZONE)
+        since = until - timedelta(days=days)
+        return await execute_run(run, job, run_key(job['name'], job['chat_id'], since, until), since, until)
+
+    run, coalesced = get_run_queue().submit(digest_key(job['chat_id'], days), start,
+                                            destinations=[destination], listener=listener)
+    return run, None, coalesced
+
+
+def cancel_digests(chat: Optional[str] = None) -> int:
+    """Отменяет запросы /digest (все или по одному чату). Плановые запуски не трогает."""
+    if chat is not None:
+        job = find_job(chat)
+        prefix = f'digest|{job["chat_id"] if job else chat}|'
+    else:
+        prefix = 'digest|'
+    return get_run_queue().cancel(lambda key: key.startswith(prefix))
+
+
+async def run_jobs(jobs=JOBS):
+    """Выполняет задачи параллельно; ошибка одной задачи не прерывает остальные."""
+    await asyncio.gather(*(pipeline(job) for job in jobs), return_exceptions=True)
+
+
+def missed_jobs(jobs, now: Optional[datetime] = None):
+    """
+    Задачи, чей последний плановый запуск был пропущен (нет отправленного отчёта в журнале)
+    не раньше SCHEDULER_MISFIRE_GRACE назад. Несколько пропусков одной задачи
+    схлопываются в один — за последнее окно.
+    """
+    if CATCHUP == 'none':
+        return []
+    now = now or datetime.now(TIMEZONE)
+    ledger = get_ledger()
+    missed = []
+    for job in jobs:
+        fire_time = last_fire_time(job_trigger(job), now)
+        if fire_time is None or (now - fire_time).total_seconds() > MISFIRE_GRACE:
+            continue
+        since, until = job_window(job, now)
+        run = ledger.get(run_key(job['name'], job['chat_id'], since, until))
+        if run is None or run.status != SENT:
+            missed.append(job)
+    return missed
+
+
+async def schedule_weekly_job(jobs=JOBS):
+    """Запускает асинхронный планировщик для всех задач дайджеста и догоняет пропущенные запуски."""
+    if not jobs:
+        logging.warning('Нет задач дайджеста: задайте TELEGRAM_CHAT_ID или JOBS_FILE')
+        return
+    scheduler = AsyncIOScheduler(timezone=TIMEZONE, job_defaults={
+        'misfire_grace_time': int(MISFIRE_GRACE),
+        'coalesce': True,
+        'max_instances': 1,
+    })
+    for job in jobs:
+        scheduler.add_job(pipeline, job_trigger(job), args=[job], name=job['name'])
+        if job['mode'] == 'incremental':
+            scheduler.add_job(daily_pipeline, CronTrigger(timezone=TIMEZONE, **job['daily_schedule']),
+                              args=[job], name=f'{job["name"]}:daily')
     scheduler.start()
+
+    missed = missed_jobs(jobs)
+    logging.info(f'Планировщик запущен ({len(jobs)} задач), пропущенных запусков: {len(missed)}')
+    await run_jobs(missed)
     try:
         await asyncio.Event().wait()
     except (KeyboardInterrupt, SystemExit):
@@ -0,0 +1,145 @@
+"""
+Локальный архив сообщений Telegram (SQLite).
+
+Хранит нормализованные сообщения по ключу (chat_id, message_id) и максимальный
+просмотренный message_id для каждого чата, чтобы последующие загрузки
+запрашивали у Telegram только новые сообщения (min_id). Начало загруженной истории
+чата хранится отдельно: окно, которое начинается раньше, догружается старыми сообщениями.
+"""
+import json
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from src.config.config import load_config
+from src.storage.sqlite import connect
+from src.telegram.records import MessageRecord
+
+config = load_config()
+ARCHIVE_PATH = config['ARCHIVE_PATH']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id    TEXT    NOT NULL,
+    message_id INTEGER NOT NULL,
+    ts         REAL    NOT NULL,
+    payload    TEXT    NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_ts ON messages (chat_id, ts);
+CREATE TABLE IF NOT EXISTS chat_state (
+    chat_id         TEXT    PRIMARY KEY,
+    last_message_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chat_coverage (
+    chat_id  TEXT PRIMARY KEY,
+    since_ts REAL NOT NULL
+);
+"""
+
+
+class MessageArchive:
+    def __init__(self, path: str = ARCHIVE_PATH):
+        self.path = path
+        self._conn = connect(path)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def get_last_message_id(self, chat_id) -> int:
+        """Возвращает максимальный просмотренный message_id чата (0, если чат ещё не загружался)."""
+        row = self._conn.execute(
+            'SELECT last_message_id FROM chat_state WHERE chat_id = ?', (str(chat_id),)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def save_messages(self, chat_id, records: Iterable[MessageRecord]):
+        """Сохраняет (или обновляет) сообщения чата в компактном виде."""
+        chat_key = str(chat_id)
+        rows = [
+            (chat_key, record.id, datetime.fromisoformat(record.date).timestamp(),
+             json.dumps(record.to_payload(), ensure_ascii=False, separators=(',', ':')))
+            for record in records
+        ]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO messages (chat_id, message_id, ts, payload) VALUES (?, ?, ?, ?)', rows
+            )
+
+    def set_last_message_id(self, chat_id, last_message_id: int):
+        """
+        Сдвигает отметку последнего просмотренного message_id. Хранится отдельно от сообщений,
+        т.к. отфильтрованные сообщения в архив не попадают, но повторно запрашивать их не нужно.
+        """
+        if not last_message_id:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO chat_state (chat_id, last_message_id) VALUES (?, ?) '
+                'ON CONFLICT(chat_id) DO UPDATE SET last_message_id = MAX(last_message_id, excluded.last_message_id)',
+                (str(chat_id), last_message_id)
+            )
+
+    def get_coverage_start(self, chat_id) -> Optional[datetime]:
+        """
+        С какого момента история чата загружена в архив (None, если чат ещё не загружался).
+        Для архивов, созданных до учёта покрытия, — время самого старого сохранённого сообщения.
+        """
+        row = self._conn.execute(
+            'SELECT since_ts FROM chat_coverage WHERE chat_id = ?', (str(chat_id),)
+        ).fetchone()
+        if row is None:
+            row = self._conn.execute('SELECT MIN(ts) FROM messages WHERE chat_id = ?', (str(chat_id),)).fetchone()
+        return datetime.fromtimestamp(row[0]) if row[0] is not None else None
+
+    def extend_coverage(self, chat_id, since: datetime, reset: bool = False):
+        """
+        Отмечает, что история чата загружена начиная с since. Обычно начало покрытия только
+        сдвигается назад; reset — в архиве дыра перед since, и более старая история не в счёт.
+        """
+        update = 'excluded.since_ts' if reset else 'MIN(since_ts, excluded.since_ts)'
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO chat_coverage (chat_id, since_ts) VALUES (?, ?) '
+                f'ON CONFLICT(chat_id) DO UPDATE SET since_ts = {update}',
+                (str(chat_id), since.timestamp())
+            )
+
+    def get_messages(self, chat_id, since: datetime, until: Optional[datetime] = None) -> List[Dict]:
+        """Возвращает сообщения чата за окно [since, until) в хронологическом порядке."""
+        until_ts = until.timestamp() if until else float('inf')
+        rows = self._conn.execute(
+            'SELECT payload FROM messages WHERE chat_id = ? AND ts >= ? AND ts < ? ORDER BY ts, message_id',
+            (str(chat_id), since.timestamp(), until_ts)
+        ).fetchall()
+        return [MessageRecord.from_payload(json.loads(row[0])).to_dict() for row in rows]
+
+    def prune(self, chat_id, before: datetime) -> int:
+        """
+        Удаляет сообщения чата старше before и сдвигает начало покрытия.
+        Возвращает число удалённых записей.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'DELETE FROM messages WHERE chat_id = ? AND ts < ?', (str(chat_id), before.timestamp())
+            )
+            self._conn.execute(
+                'UPDATE chat_coverage SET since_ts = MAX(since_ts, ?) WHERE chat_id = ?',
+                (before.timestamp(), str(chat_id))
+            )
+        return cursor.rowcount
+
+    def close(self):
+        self._conn.close()
+
+
+_archive: Optional[MessageArchive] = None
+
+
+def get_archive() -> MessageArchive:
+    """Возвращает общий для процесса экземпляр архива."""
+    global _archive
+    if _archive is None:
+        _archive = MessageArchive()
+    return _archive
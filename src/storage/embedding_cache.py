@@ -0,0 +1,109 @@
+"""
+Персистентный кэш эмбеддингов (SQLite).
+
+Ключ — (модель, sha256 текста), значение — вектор float32 в виде компактного blob.
+Размер кэша ограничен: при переполнении вытесняются давно не использованные записи.
+"""
+import hashlib
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+from src.config.config import load_config
+from src.storage.sqlite import connect
+
+config = load_config()
+RAG_CONFIG = config['RAG_CONFIG']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model     TEXT    NOT NULL,
+    hash      TEXT    NOT NULL,
+    dim       INTEGER NOT NULL,
+    vector    BLOB    NOT NULL,
+    last_used REAL    NOT NULL,
+    PRIMARY KEY (model, hash)
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used);
+"""
+
+# SQLite ограничивает число параметров в запросе, поэтому выборка идёт пачками
+LOOKUP_CHUNK = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = RAG_CONFIG['cache_path'], max_items: int = RAG_CONFIG['cache_max_items']):
+        self.path = path
+        self.max_items = max_items
+        self._conn = connect(path)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Возвращает найденные в кэше векторы по хэшам текстов и обновляет их время использования."""
+        unique = list(dict.fromkeys(hashes))
+        found: Dict[str, np.ndarray] = {}
+        for start in range(0, len(unique), LOOKUP_CHUNK):
+            chunk = unique[start:start + LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self._conn.execute(
+                f'SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})',
+                (model, *chunk)
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        if found:
+            now = time.time()
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    'UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?',
+                    [(now, model, key) for key in found]
+                )
+        return found
+
+    def put_many(self, model: str, items: Dict[str, np.ndarray]):
+        """Сохраняет векторы и вытесняет самые старые записи при превышении лимита."""
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (model, key, len(vector), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (model, hash, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)', rows
+            )
+            self._evict()
+
+    def _evict(self):
+        if not self.max_items:
+            return
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()
+        overflow = count - self.max_items
+        if overflow > 0:
+            self._conn.execute(
+                'DELETE FROM embeddings WHERE rowid IN '
+                '(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)', (overflow,)
+            )
+
+    def close(self):
+        self._conn.close()
+
+
+_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Возвращает общий для процесса экземпляр кэша эмбеддингов."""
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
+
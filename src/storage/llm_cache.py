@@ -0,0 +1,101 @@
+"""
+Дисковый кэш ответов LLM (SQLite) с TTL и ограничением по числу записей.
+
+Ключ — sha256 от (провайдер, модель, температура, хэш промпта, хэш содержимого, хэш схемы
+ответа), значение — JSON-ответ модели.
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+from src.config.config import load_config
+from src.storage.sqlite import connect
+
+config = load_config()
+LLM_CONFIG = config['LLM_CONFIG']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key       TEXT PRIMARY KEY,
+    response  TEXT NOT NULL,
+    created   REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_responses_last_used ON llm_responses (last_used);
+"""
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def make_key(provider: str, model: str, temperature: float, prompt: str, content: str, schema: Dict) -> str:
+    parts = [
+        provider, model, repr(temperature),
+        sha256(prompt), sha256(content),
+        sha256(json.dumps(schema, sort_keys=True, ensure_ascii=False)),
+    ]
+    return sha256('\x1f'.join(parts))
+
+
+class LLMCache:
+    def __init__(self, path: str = LLM_CONFIG['cache_path'], ttl: float = LLM_CONFIG['cache_ttl'],
+                 max_entries: int = LLM_CONFIG['cache_max_entries']):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn = connect(path)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Возвращает ответ из кэша, если он есть и не старше TTL."""
+        row = self._conn.execute('SELECT response, created FROM llm_responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        response, created = row
+        now = time.time()
+        with self._lock, self._conn:
+            if self.ttl and now - created > self.ttl:
+                self._conn.execute('DELETE FROM llm_responses WHERE key = ?', (key,))
+                return None
+            self._conn.execute('UPDATE llm_responses SET last_used = ? WHERE key = ?', (now, key))
+        return json.loads(response)
+
+    def put(self, key: str, response: Dict):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO llm_responses (key, response, created, last_used) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(response, ensure_ascii=False), now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now: float):
+        if self.ttl:
+            self._conn.execute('DELETE FROM llm_responses WHERE created < ?', (now - self.ttl,))
+        if not self.max_entries:
+            return
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM llm_responses').fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                'DELETE FROM llm_responses WHERE key IN '
+                '(SELECT key FROM llm_responses ORDER BY last_used LIMIT ?)', (overflow,)
+            )
+
+    def close(self):
+        self._conn.close()
+
+
+_cache: Optional[LLMCache] = None
+
+
+def get_llm_cache() -> LLMCache:
+    """Возвращает общий для процесса экземпляр кэша ответов LLM."""
+    global _cache
+    if _cache is None:
+        _cache = LLMCache()
+    return _cache
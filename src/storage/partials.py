@@ -0,0 +1,77 @@
+"""
+Хранилище дневных частичных отчётов (SQLite) для инкрементального режима.
+
+Ключ — (chat_id, день), значение — JSON LLMResponse за этот день. День без сообщений
+хранится с пустым отчётом, чтобы не пересчитывать его повторно.
+"""
+import json
+import threading
+import time
+from datetime import date
+from typing import Dict, Iterable, Optional
+
+from src.config.config import load_config
+from src.storage.sqlite import connect
+
+config = load_config()
+PARTIALS_PATH = config['PARTIALS_PATH']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS partials (
+    chat_id       TEXT    NOT NULL,
+    day           TEXT    NOT NULL,
+    report        TEXT,
+    message_count INTEGER NOT NULL,
+    created       REAL    NOT NULL,
+    PRIMARY KEY (chat_id, day)
+);
+"""
+
+
+class PartialStore:
+    def __init__(self, path: str = PARTIALS_PATH):
+        self.path = path
+        self._conn = connect(path)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def get_many(self, chat_id, days: Iterable[date]) -> Dict[date, Optional[Dict]]:
+        """Возвращает посчитанные дни из days: день → отчёт (None — в этот день сообщений не было)."""
+        days = list(days)
+        if not days:
+            return {}
+        placeholders = ','.join('?' * len(days))
+        rows = self._conn.execute(
+            f'SELECT day, report FROM partials WHERE chat_id = ? AND day IN ({placeholders})',
+            (str(chat_id), *(day.isoformat() for day in days))
+        ).fetchall()
+        return {date.fromisoformat(day): json.loads(report) if report else None for day, report in rows}
+
+    def put(self, chat_id, day: date, report: Optional[Dict], message_count: int):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO partials (chat_id, day, report, message_count, created) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (str(chat_id), day.isoformat(),
+                 json.dumps(report, ensure_ascii=False) if report else None, message_count, time.time())
+            )
+
+    def prune(self, chat_id, before: date) -> int:
+        with self._lock, self._conn:
+            cursor = self._conn.execute('DELETE FROM partials WHERE chat_id = ? AND day < ?',
+                                        (str(chat_id), before.isoformat()))
+        return cursor.rowcount
+
+    def close(self):
+        self._conn.close()
+
+
+_store: Optional[PartialStore] = None
+
+
+def get_partial_store() -> PartialStore:
+    """Возвращает общий для процесса экземпляр хранилища частичных отчётов."""
+    global _store
+    if _store is None:
+        _store = PartialStore()
+    return _store
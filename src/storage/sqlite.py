@@ -0,0 +1,16 @@
+"""
+Общие хелперы для локальных SQLite-хранилищ (архив сообщений, кэши, журнал запусков).
+"""
+import os
+import sqlite3
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Открывает SQLite-базу, создавая каталог при необходимости, и включает WAL."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
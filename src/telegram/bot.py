@@ -1,23 +1,37 @@
+import asyncio
 import io
 import json
+import logging
+from typing import Set
 from aiogram.types import BufferedInputFile, BotCommand
 from src.config.config import load_config
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 
-from src.telegram.telethon_client import get_list_chats
+config = load_config()
 
 # Описание команд для меню Telegram
 BOT_COMMANDS = [
     BotCommand(command="start", description="Приветствие и краткая справка"),
     BotCommand(command="help", description="Подробная справка по боту"),
     BotCommand(command="list_chats_json", description="Получить список чатов в JSON"),
+    BotCommand(command="digest", description="Отчёт по чату сейчас: /digest <чат> [дней]"),
+    BotCommand(command="cancel", description="Отменить запросы /digest"),
 ]
 
+# Фоновые ожидания запусков /digest: хендлеры не ждут пайплайн, ссылки держим до завершения
+_background: Set[asyncio.Task] = set()
+
+
+def spawn(coro):
+    task = asyncio.ensure_future(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
 async def run_bot():
-    bot = Bot(token=load_config().get('BOT_TOKEN'))
+    bot = Bot(token=config.get('BOT_TOKEN'))
     dp = Dispatcher()
-    config = load_config()
     OWNER_ID = config.get('TELEGRAM_OWNER_ID')
 
     def is_owner(message: types.Message) -> bool:
@@ -38,7 +52,7 @@ async def run_bot():
         if not is_owner(message):
             return
         await message.answer(
-            "Я автоматически собираю сообщения за неделю, генерирую отчёт и отправляю его в этот чат.\n\nДоступные команды:\n/start — приветствие\n/help — справка\n/auth — авторизация Telethon\n/list_chats_json — список чатов в JSON")
+            "Я автоматически собираю сообщения за неделю, генерирую отчёт и отправляю его в этот чат.\n\nДоступные команды:\n/start — приветствие\n/help — справка\n/auth — авторизация Telethon\n/list_chats_json — список чатов в JSON\n/digest <чат> [дней] — отчёт по чату сейчас (чат — имя задачи, ID или @username)\n/cancel [чат] — отменить запросы /digest")
 
     @dp.message(Command("list_chats_json"))
     async def cmd_list_chats_json(message: types.Message):
@@ -46,7 +60,8 @@ async def run_bot():
             return
         temp_message = await message.answer("🔄 Генерирую отчёт по чатам, подожди пару секунд...")
 
-        # Получаем список чатов
+        # Telethon нужен только этой команде — импортируем при первом вызове
+        from src.telegram.telethon_client import get_list_chats
         chats = await get_list_chats()
         json_text = json.dumps(chats, ensure_ascii=False, indent=2)
 
@@ -57,4 +72,70 @@ async def run_bot():
 
         await temp_message.delete()
 
+    @dp.message(Command("digest"))
+    async def cmd_digest(message: types.Message, command: CommandObject):
+        if not is_owner(message):
+            return
+        args = (command.args or '').split()
+        if not 1 <= len(args) <= 2 or (len(args) == 2 and (not args[1].isdigit() or int(args[1]) == 0)):
+            await message.answer("Использование: /digest <чат> [дней], например /digest team 3")
+            return
+        chat, days = args[0], int(args[1]) if len(args) == 2 else None
+
+        # Планировщик, журнал и отправка отчётов нужны только этой команде
+        from src.scheduler.job_queue import QueueFull, get_run_queue
+        from src.scheduler.scheduler import request_digest
+        from src.telegram.sender import deliver_report
+
+        status = await message.answer("🔄 Ставлю запрос в очередь...")
+
+        async def progress(text: str):
+            try:
+                await status.edit_text(text)
+            except Exception as e:
+                logging.warning(f'Не удалось обновить статус /digest: {e}')
+
+        try:
+            run, cached, coalesced = request_digest(chat, days, str(message.chat.id), progress)
+        except QueueFull as e:
+            await progress(f"⏳ Очередь заполнена, попробуй позже ({e})")
+            return
+        except ValueError as e:
+            await progress(f"⚠️ Слишком длинное окно: {e}")
+            return
+        if cached is not None:
+            async def send_cached():
+                errors = await deliver_report(cached.report, [str(message.chat.id)])
+                if any(errors.values()):
+                    await progress("❌ Не удалось отправить отчёт")
+                else:
+                    await progress(f"✅ Отчёт уже посчитан за окно до {cached.window_end:%d.%m %H:%M}")
+
+            spawn(send_cached())
+            return
+        position = get_run_queue().position(run)
+        if coalesced:
+            await progress("🔁 Такой же запрос уже в работе — пришлю его результат")
+        elif position is not None:
+            await progress(f"🕒 В очереди, впереди запусков: {position}")
+
+        async def wait_result():
+            try:
+                await run.wait()
+                await progress("✅ Отчёт готов")
+            except asyncio.CancelledError:
+                await progress("🚫 Запрос отменён")
+            except Exception as e:
+                await progress(f"❌ Ошибка: {str(e)[:300]}")
+
+        spawn(wait_result())
+
+    @dp.message(Command("cancel"))
+    async def cmd_cancel(message: types.Message, command: CommandObject):
+        if not is_owner(message):
+            return
+        from src.scheduler.scheduler import cancel_digests
+        cancelled = cancel_digests(command.args.strip() if command.args else None)
+        await message.answer(f"🚫 Отменено запросов: {cancelled}" if cancelled else "Нет запросов /digest в работе")
+
     await dp.start_polling(bot)
@@ -0,0 +1,77 @@
+"""
+Общий для процесса Telethon-клиент: ленивое подключение, проверка живости,
+переподключение и корректное завершение. Используется и ботом, и планировщиком,
+чтобы не платить за MTProto-рукопожатие и не блокировать SQLite-файл сессии.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from telethon import TelegramClient
+
+from src.config.config import load_config
+
+config = load_config()
+
+API_ID = config['TELEGRAM_API_ID']
+API_HASH = config['TELEGRAM_API_HASH']
+PHONE = config['TELEGRAM_PHONE']
+SESSION_NAME = config['TELEGRAM_SESSION_NAME']
+# Как часто (в секундах) проверять живость соединения запросом get_me
+HEALTH_CHECK_INTERVAL = 60
+HEALTH_CHECK_TIMEOUT = 10
+
+
+class TelethonClientManager:
+    def __init__(self):
+        self._client: Optional[TelegramClient] = None
+        self._lock = asyncio.Lock()
+        self._last_check = 0.0
+
+    async def get_client(self) -> TelegramClient:
+        """Возвращает подключённый и авторизованный клиент, при необходимости переподключаясь."""
+        async with self._lock:
+            if self._client is None:
+                if API_ID is None:
+                    raise ValueError('TELEGRAM_API_ID не задан')
+                self._client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
+            if not self._client.is_connected():
+                await self._connect()
+            elif time.monotonic() - self._last_check > HEALTH_CHECK_INTERVAL and not await self._is_healthy():
+                logging.warning('Telethon-соединение не отвечает, переподключаемся...')
+                await self._client.disconnect()
+                await self._connect()
+            return self._client
+
+    async def _connect(self):
+        await self._client.start(phone=PHONE)
+        self._last_check = time.monotonic()
+        logging.info('Telethon-клиент подключён')
+
+    async def _is_healthy(self) -> bool:
+        try:
+            await asyncio.wait_for(self._client.get_me(input_peer=True), HEALTH_CHECK_TIMEOUT)
+        except Exception as e:
+            logging.warning(f'Проверка Telethon-соединения не прошла: {e}')
+            return False
+        self._last_check = time.monotonic()
+        return True
+
+    async def shutdown(self):
+        async with self._lock:
+            if self._client is not None and self._client.is_connected():
+                await self._client.disconnect()
+                logging.info('Telethon-клиент отключён')
+            self._client = None
+
+
+client_manager = TelethonClientManager()
+
+
+async def get_telegram_client() -> TelegramClient:
+    return await client_manager.get_client()
+
+
+async def shutdown_telegram_client():
+    await client_manager.shutdown()
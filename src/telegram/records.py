@@ -0,0 +1,78 @@
+"""
+Компактная запись сообщения для загрузки и архива.
+
+Вместо словаря из 14 ключей — dataclass со __slots__, медиа-признаки упакованы
+в битовую маску, пустые поля в архив не пишутся. Остальной код (RAG, LLM) получает
+прежний словарь через to_dict().
+"""
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+PHOTO = 1
+DOCUMENT = 2
+VIDEO = 4
+VOICE = 8
+
+FLAG_NAMES = (('photo', PHOTO), ('document', DOCUMENT), ('video', VIDEO), ('voice', VOICE))
+
+
+@dataclass(slots=True)
+class MessageRecord:
+    id: int
+    date: str
+    username: str
+    text: str = ''
+    reply_to: Optional[int] = None
+    caption: str = ''
+    flags: int = 0
+    document_name: str = ''
+    media_type: str = ''
+    links: Tuple[str, ...] = ()
+
+    def to_dict(self) -> Dict:
+        """Полный словарь сообщения в формате, который ожидают RAG и LLM."""
+        data = {
+            'id': self.id,
+            'date': self.date,
+            'username': self.username,
+            'reply_to': self.reply_to,
+            'text': self.text,
+            'caption': self.caption,
+            'document_name': self.document_name,
+            'media_type': self.media_type,
+            'links': list(self.links),
+        }
+        for name, bit in FLAG_NAMES:
+            data[name] = bool(self.flags & bit)
+        return data
+
+    def to_payload(self) -> Dict:
+        """Компактное представление для архива: только непустые поля."""
+        payload = {'id': self.id, 'date': self.date, 'username': self.username}
+        for name in ('text', 'reply_to', 'caption', 'flags', 'document_name', 'media_type'):
+            value = getattr(self, name)
+            if value:
+                payload[name] = value
+        if self.links:
+            payload['links'] = list(self.links)
+        return payload
+
+    @classmethod
+    def from_payload(cls, payload: Dict) -> 'MessageRecord':
+        """Восстанавливает запись из архива; понимает и старый формат со словарём из 14 ключей."""
+        flags = payload.get('flags', 0)
+        for name, bit in FLAG_NAMES:
+            if payload.get(name):
+                flags |= bit
+        return cls(
+            id=payload['id'],
+            date=payload['date'],
+            username=payload.get('username', 'Anonymous'),
+            text=payload.get('text', ''),
+            reply_to=payload.get('reply_to'),
+            caption=payload.get('caption', ''),
+            flags=flags,
+            document_name=payload.get('document_name', ''),
+            media_type=payload.get('media_type', ''),
+            links=tuple(payload.get('links', ())),
+        )
@@ -1,15 +1,33 @@
 """
 Модуль для отправки итогового отчёта в Telegram-чат через aiogram (Bot API).
+
+Отправкой занимается долгоживущий ReportSender: одна сессия бота на процесс,
+HTML-безопасная разбивка длинных отчётов по лимиту Telegram, token-bucket
+ограничение скорости (глобальное и на чат) с учётом RetryAfter и параллельная
+рассылка по нескольким чатам с повторами.
 """
+import asyncio
 import html
+import logging
+import re
+import time
+from typing import Dict, Iterable, List, Optional
 from aiogram import Bot
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
 from datetime import datetime
 
 from src.config.config import load_config
+from src.metrics.metrics import incr, stage
 
 config = load_config()
 BOT_TOKEN = config['BOT_TOKEN']
+SENDER_CONFIG = config['SENDER_CONFIG']
+
+# Лимит длины текста сообщения Bot API
+TELEGRAM_MESSAGE_LIMIT = 4096
+TAG_PATTERN = re.compile(r'<(/?)([a-zA-Z-]+)[^>]*>')
+CLOSING_TAGS_RESERVE = 64
 
 
 def escape_html(text: str) -> str:
@@ -50,9 +68,169 @@ def format_report(report_json: dict) -> str:
     return '\n'.join(parts)
 
 
-async def send_report(report_json: dict, chat_id: str):
-    bot = Bot(token=BOT_TOKEN)
-    try:
-        await bot.send_message(chat_id, format_report(report_json), parse_mode=ParseMode.HTML)
-    finally:
-        await bot.session.close()
+def _markup_start(text: str, cut: int) -> int:
+    """Сдвигает разрез к началу тега <...> или HTML-сущности &...;, если он попал внутрь них."""
+    tag_start, entity_start = text.rfind('<', 0, cut), text.rfind('&', 0, cut)
+    if tag_start > text.rfind('>', 0, cut):
+        cut = tag_start
+    if entity_start > text.rfind(';', 0, cut):
+        cut = min(cut, entity_start)
+    return cut
+
+
+def _safe_cut(text: str, limit: int) -> int:
+    """
+    Позиция разреза не дальше limit: по переводу строки, иначе по пробелу во второй половине
+    окна (чтобы не отправлять крошечные части), иначе жёстко по limit; не внутри тега или сущности.
+    """
+    for separator in ('\n', ' '):
+        cut = text.rfind(separator, limit // 2, limit)
+        if cut > 0:
+            cut = _markup_start(text, cut)
+            if cut > limit // 2:
+                return cut
+    return _markup_start(text, limit) or limit
+
+
+def split_html(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Делит HTML-текст на части не длиннее limit. Теги, открытые на границе части,
+    закрываются в её конце и открываются заново в начале следующей.
+    """
+    parts: List[str] = []
+    open_tags: List[str] = []
+    while text:
+        prefix = ''.join(open_tags)
+        # Запас под закрывающие теги, которые понадобятся в конце части
+        budget = limit - len(prefix) - CLOSING_TAGS_RESERVE
+        if len(text) <= budget:
+            parts.append(prefix + text)
+            break
+        cut = _safe_cut(text, budget)
+        piece, text = text[:cut], text[cut:].lstrip('\n')
+        tags = list(open_tags)
+        for match in TAG_PATTERN.finditer(piece):
+            if match.group(1):
+                if tags and tags[-1].startswith(f'<{match.group(2)}'):
+                    tags.pop()
+            else:
+                tags.append(match.group(0))
+        closing = ''.join(f'</{TAG_PATTERN.match(tag).group(2)}>' for tag in reversed(tags))
+        parts.append(prefix + piece + closing)
+        open_tags = tags
+    return [part for part in parts if part.strip()]
+
+
+class TokenBucket:
+    """Token bucket: не больше rate отправок в секунду с всплесками до capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds: float):
+        """Приостанавливает выдачу токенов (например, по RetryAfter от Telegram)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class ReportSender:
+    def __init__(self, token: str = BOT_TOKEN):
+        self.token = token
+        self._bot: Optional[Bot] = None
+        self.global_bucket = TokenBucket(SENDER_CONFIG['global_rate'], SENDER_CONFIG['global_rate'])
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+
+    @property
+    def bot(self) -> Bot:
+        if self._bot is None:
+            self._bot = Bot(token=self.token)
+        return self._bot
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        key = str(chat_id)
+        if key not in self._chat_buckets:
+            self._chat_buckets[key] = TokenBucket(SENDER_CONFIG['chat_rate'], SENDER_CONFIG['chat_burst'])
+        return self._chat_buckets[key]
+
+    async def send_text(self, chat_id, text: str):
+        """Отправляет HTML-текст в чат, при необходимости разбивая его на несколько сообщений."""
+        for part in split_html(text):
+            await self._send_part(chat_id, part)
+
+    async def _send_part(self, chat_id, text: str):
+        chat_bucket = self._chat_bucket(chat_id)
+        max_retries = SENDER_CONFIG['max_retries']
+        for attempt in range(max_retries + 1):
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text, parse_mode=ParseMode.HTML)
+                incr('telegram_messages_sent')
+                return
+            except TelegramRetryAfter as e:
+                if attempt >= max_retries:
+                    raise
+                logging.warning(f'Telegram просит подождать {e.retry_after} с перед отправкой в {chat_id}')
+                incr('telegram_send_retries')
+                # Flood wait действует на весь бот: останавливаем и остальные рассылки
+                chat_bucket.block(e.retry_after)
+                self.global_bucket.block(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt >= max_retries:
+                    raise
+                delay = min(2 ** attempt, 30)
+                logging.warning(f'Ошибка отправки в {chat_id}: {e}. Повтор через {delay} с')
+                incr('telegram_send_retries')
+                await asyncio.sleep(delay)
+
+    async def broadcast(self, text: str, chat_ids: Iterable) -> Dict[str, Optional[Exception]]:
+        """Параллельно рассылает текст по чатам. Возвращает ошибку (или None) для каждого чата."""
+        chat_ids = [str(chat_id) for chat_id in chat_ids]
+        results = await asyncio.gather(*(self.send_text(chat_id, text) for chat_id in chat_ids),
+                                       return_exceptions=True)
+        return {chat_id: result if isinstance(result, Exception) else None
+                for chat_id, result in zip(chat_ids, results)}
+
+    async def close(self):
+        if self._bot is not None:
+            await self._bot.session.close()
+            self._bot = None
+
+
+report_sender = ReportSender()
+
+
+async def deliver_report(report_json: dict, chat_ids: Iterable) -> Dict[str, Optional[Exception]]:
+    """Рассылает отчёт по чатам и возвращает ошибку (или None) для каждого чата."""
+    chat_ids = [str(chat_id) for chat_id in chat_ids]
+    text = format_report(report_json)
+    with stage('send_report', items=len(chat_ids)) as handle:
+        handle.bytes = len(text.encode('utf-8')) * len(chat_ids)
+        errors = await report_sender.broadcast(text, chat_ids)
+    for chat_id, error in errors.items():
+        if error is not None:
+            logging.error(f'Не удалось отправить отчёт в {chat_id}: {error}')
+    return errors
+
+
+async def close_sender():
+    await report_sender.close()
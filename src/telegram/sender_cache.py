@@ -0,0 +1,75 @@
+"""
+Кэш имён отправителей по чатам: id → отформатированное имя с TTL.
+
+Кэш прогревается одним вызовом get_participants, после чего имя отправителя
+для каждого сообщения берётся из словаря, а не форматируется заново.
+"""
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from src.config.config import load_config
+
+config = load_config()
+SENDER_CACHE_TTL = config['SENDER_CACHE_TTL']
+SENDER_CACHE_WARM = config['SENDER_CACHE_WARM']
+
+
+def get_formatted_username(sender) -> str:
+    # У сообщений от имени канала или анонимного админа отправитель может отсутствовать
+    if sender is None:
+        return "Unknown"
+    if getattr(sender, 'username', None):
+        return f"@{sender.username}"
+    first_name = getattr(sender, 'first_name', None)
+    last_name = getattr(sender, 'last_name', None)
+    if first_name and last_name:
+        return f"{first_name} {last_name}".strip()
+    return first_name or getattr(sender, 'title', None) or "Unknown"
+
+
+class SenderCache:
+    def __init__(self, ttl: float = SENDER_CACHE_TTL):
+        self.ttl = ttl
+        self._names: Dict[int, Tuple[str, float]] = {}
+        self._warmed_at: Optional[float] = None
+
+    def put(self, sender_id: int, sender) -> str:
+        name = get_formatted_username(sender)
+        self._names[sender_id] = (name, time.monotonic())
+        return name
+
+    def resolve(self, msg) -> str:
+        """Имя отправителя сообщения: из кэша, если запись свежая, иначе из msg.sender."""
+        sender_id = msg.sender_id
+        cached = self._names.get(sender_id)
+        if cached and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        return self.put(sender_id, msg.sender)
+
+    async def warm(self, client, entity):
+        """Одним запросом загружает участников чата, если кэш ещё не прогревался или устарел."""
+        if not SENDER_CACHE_WARM or (self._warmed_at is not None and time.monotonic() - self._warmed_at < self.ttl):
+            return
+        self._warmed_at = time.monotonic()
+        try:
+            participants = await client.get_participants(entity)
+        except Exception as e:
+            # Например, для каналов без прав администратора
+            logging.warning(f'Не удалось прогреть кэш отправителей: {e}')
+            return
+        for user in participants:
+            self.put(user.id, user)
+        logging.info(f'Кэш отправителей прогрет: {len(participants)} участников')
+
+
+_caches: Dict[str, SenderCache] = {}
+
+
+def get_sender_cache(chat_key) -> SenderCache:
+    """Возвращает кэш отправителей чата (один на процесс)."""
+    key = str(chat_key)
+    cache: Optional[SenderCache] = _caches.get(key)
+    if cache is None:
+        cache = _caches[key] = SenderCache()
+    return cache
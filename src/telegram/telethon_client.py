@@ -2,74 +2,108 @@
 Модуль для работы с историей сообщений из Telegram-чатов через Telethon (user session).
 """
 import re
-from datetime import datetime, timedelta
-from typing import List, Dict
-from telethon.tl.types import User
-from telethon import TelegramClient
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Dict, Optional
+from telethon import utils
 from src.config.config import load_config
+from src.telegram.client_manager import get_telegram_client
+from src.telegram.records import DOCUMENT, PHOTO, VIDEO, VOICE, MessageRecord
+from src.telegram.sender_cache import SenderCache, get_formatted_username
 
 config = load_config()
 
-API_ID = config['TELEGRAM_API_ID']
-API_HASH = config['TELEGRAM_API_HASH']
-PHONE = config['TELEGRAM_PHONE']
-SESSION_NAME = config['TELEGRAM_SESSION_NAME']
-DAY_OFFSET = config['DAY_OFFSET']
 IGNORED_SENDER_IDS = config['IGNORED_SENDER_IDS']
 IGNORED_PREFIXES = ['/start', '/help', '/telegram', '/command', '🎆Дай мне мудрость']
 
+LINK_PATTERN = re.compile(r'(https?://\S+)')
+TELEGRAM_MENTION_PATTERN = re.compile(r'@\w*telegram\w*', re.IGNORECASE)
 
-def get_telegram_client():
-    return TelegramClient(SESSION_NAME, API_ID, API_HASH)
 
+async def open_chat(chat_id_or_username: str):
+    """Возвращает общий клиент, сущность чата и его peer id (ключ чата в архиве)."""
+    client = await get_telegram_client()
+    entity = await find_entity(client, chat_id_or_username)
+    return client, entity, utils.get_peer_id(entity)
 
-async def get_messages(chat_id_or_username: str, day_offset: int = DAY_OFFSET) -> list[dict]:
-    since = datetime.now() - timedelta(days=day_offset)
-    messages = []
 
-    client = get_telegram_client()
-    await client.start(phone=PHONE)
+def to_utc(moment: datetime) -> datetime:
+    """Telethon отдаёт даты в UTC, а наивные даты считает UTC; наивное время пайплайна — локальное."""
+    return moment.astimezone(timezone.utc)
 
-    # Найдём нужный чат
-    entity = await find_entity(client, chat_id_or_username)
 
-    # Загружаем только сообщения за последние 7 дней
-    async for msg in client.iter_messages(entity):
-        if msg.date.replace(tzinfo=None) < since:
+async def iter_new_messages(client, entity, min_id: int, since: datetime,
+                            stats: Optional[Dict] = None) -> AsyncIterator:
+    """
+    Отдаёт сообщения чата от новых к старым: только с id больше min_id
+    и не старше since (окно DAY_OFFSET). Если поток оборвался по дате, не дойдя
+    до min_id, в stats['truncated'] записывается True: между min_id и since осталась дыра.
+    """
+    since = to_utc(since)
+    async for msg in client.iter_messages(entity, min_id=min_id):
+        if msg.date < since:
+            if stats is not None:
+                stats['truncated'] = True
+            break
+        yield msg
+
+
+async def iter_old_messages(client, entity, before: datetime, since: datetime) -> AsyncIterator:
+    """
+    Отдаёт от новых к старым сообщения старше before и не старше since:
+    догрузка истории, которой ещё нет в архиве.
+    """
+    since = to_utc(since)
+    async for msg in client.iter_messages(entity, offset_date=to_utc(before)):
+        if msg.date < since:
             break
-        # Собираем полный контекст сообщения
-        if (getattr(msg, 'text', None) or getattr(msg, 'caption', None) or getattr(msg, 'media',
-                                                                                   None)) and not should_skip_message(
-                msg):
-            # Корректно извлекаем имя файла документа
-            document_name = ''
-            if hasattr(msg, 'document') and msg.document:
-                for attr in getattr(msg.document, 'attributes', []):
-                    # DocumentAttributeFilename — только у файлов
-                    if hasattr(attr, 'file_name'):
-                        document_name = attr.file_name
-                        break
-
-            message_data = {
-                'id': msg.id,
-                'date': msg.date.isoformat(),
-                'username': get_formatted_username(msg.sender),
-                'reply_to': msg.reply_to_msg_id,
-                'text': getattr(msg, 'text', '') or '',
-                'caption': getattr(msg, 'caption', '') or '',
-                'photo': hasattr(msg, 'photo') and msg.photo is not None,
-                'document': hasattr(msg, 'document') and msg.document is not None,
-                'document_name': document_name,
-                'video': hasattr(msg, 'video') and msg.video is not None,
-                'voice': hasattr(msg, 'voice') and msg.voice is not None,
-                'media_type': type(msg.media).__name__ if getattr(msg, 'media', None) else '',
-                'links': re.findall(r'(https?://\S+)',
-                                    (getattr(msg, 'text', '') or '') + (getattr(msg, 'caption', '') or ''))
-            }
-            messages.insert(0, message_data)
-
-    await client.disconnect()
-    return messages
+        yield msg
+
+
+def is_relevant(msg) -> bool:
+    """Сообщение с содержимым, которое не отфильтровано should_skip_message."""
+    return bool(getattr(msg, 'text', None) or getattr(msg, 'caption', None)
+                or getattr(msg, 'media', None)) and not should_skip_message(msg)
+
+
+def extract_links(text: str) -> List[str]:
+    # Дешёвая проверка, чтобы не гонять регулярку по каждому сообщению
+    if 'http' not in text:
+        return []
+    return LINK_PATTERN.findall(text)
+
+
+def normalize_message(msg, senders: Optional[SenderCache] = None) -> MessageRecord:
+    """Приводит сообщение Telethon к компактной записи, которая хранится в архиве."""
+    flags = 0
+    document_name = ''
+    if msg.photo is not None:
+        flags |= PHOTO
+    if msg.document is not None:
+        flags |= DOCUMENT
+        # Корректно извлекаем имя файла документа (DocumentAttributeFilename — только у файлов)
+        for attr in getattr(msg.document, 'attributes', []):
+            if hasattr(attr, 'file_name'):
+                document_name = attr.file_name
+                break
+    if msg.video is not None:
+        flags |= VIDEO
+    if msg.voice is not None:
+        flags |= VOICE
+
+    text = msg.text or ''
+    caption = getattr(msg, 'caption', '') or ''
+    return MessageRecord(
+        id=msg.id,
+        date=msg.date.isoformat(),
+        username=senders.resolve(msg) if senders else get_formatted_username(msg.sender),
+        text=text,
+        reply_to=msg.reply_to_msg_id,
+        caption=caption,
+        flags=flags,
+        document_name=document_name,
+        media_type=type(msg.media).__name__ if msg.media else '',
+        links=tuple(extract_links(text + caption)),
+    )
 
 
 def should_skip_message(msg) -> bool:
@@ -87,7 +121,7 @@ def should_skip_message(msg) -> bool:
     if not text:
         return True
     # Игнорируем бот-команды и сообщения с @telegram
-    if text.startswith('/') or re.search(r'@\w*telegram\w*', text, re.IGNORECASE):
+    if text.startswith('/') or TELEGRAM_MENTION_PATTERN.search(text):
         return True
 
     return False
@@ -110,20 +144,11 @@ async def find_entity(client, chat_id_or_username):
     raise ValueError(f"Чат с id/username '{chat_id_or_username}' не найден среди ваших диалогов!")
 
 
-def get_formatted_username(sender: User) -> str:
-    if sender.username:
-        return f"@{sender.username}"
-    if sender.first_name and sender.last_name:
-        return f"{sender.first_name} {sender.last_name}".strip()
-    return sender.first_name or "Unknown"
-
-
 async def get_list_chats() -> List[Dict]:
     """
     Возвращает список всех чатов пользователя (id, name, username) в виде JSON-объекта.
     """
-    client = get_telegram_client()
-    await client.start(phone=PHONE)
+    client = await get_telegram_client()
 
     chats = []
     async for dialog in client.iter_dialogs():
@@ -134,6 +159,4 @@ async def get_list_chats() -> List[Dict]:
         }
         chats.append(chat_info)
 
-    await client.disconnect()
-
     return chats